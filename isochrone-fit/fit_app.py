@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# Bokeh server version of make_example_plot.py for model grids too large to ship in a page:
+#   bokeh serve fit_app.py --args [--amplitudes 2 4 6 8 10] [--periods 1:5.5:0.5] [--cache-size 256]
+# the static page holds every amplitude x period curve, hidden, and shifts all of them on every
+# slider move. here the server generates only the curves of the selected amplitude and the checked
+# periods, when they are shown, and keeps the last --cache-size of them in an LRU cache. a line is
+# created the first time its period is shown. the offsets are applied in the browser, as in the
+# static page, so moving the sliders does not go through the server
+import argparse
+import numpy as np
+from bokeh.io import curdoc
+from bokeh.layouts import column, row
+from bokeh.models import CustomJS, Slider, CheckboxGroup, CheckboxButtonGroup, Div, Select, Button, Dodge
+from bokeh.plotting import ColumnDataSource, figure
+from bokeh.transform import transform
+from model_curves import AMPLITUDES, PERIODS, N_POINTS, cached_curves, observations
+
+
+def grid_values(tokens):
+    """widget values (strings) of a grid given as values and/or start:stop:step ranges"""
+    values = []
+    for t in tokens:
+        if ':' in t:
+            start, stop, step = (float(v) for v in t.split(':'))
+            values += ['%g' % v for v in np.arange(start, stop, step)]
+        else:
+            values.append(t)
+    return values
+
+
+parser = argparse.ArgumentParser(description='Fit model curves to observations in a Bokeh server app.')
+parser.add_argument('--amplitudes', nargs='+', default=AMPLITUDES, help='amplitudes, values or start:stop:step')
+parser.add_argument('--periods', nargs='+', default=PERIODS, help='periods, values or start:stop:step')
+parser.add_argument('--points', type=int, default=N_POINTS, help='points per model curve')
+parser.add_argument('--cache-size', type=int, default=256, help='model curves kept in memory')
+parser.add_argument('--seed', type=int, default=None, help='seed of the random observations')
+args = parser.parse_args()
+
+amplitude_list = grid_values(args.amplitudes)
+period_list = grid_values(args.periods)
+curve = cached_curves(args.cache_size, args.points)
+
+x_data, y_data = observations(np.random.default_rng(args.seed))
+
+#build plot
+a_init = amplitude_list[min(2, len(amplitude_list) - 1)]
+p_init = period_list[0]
+x_i = 0
+y_i = 0
+
+plot = figure(y_range=(1.02*y_data.min(),1.02*y_data.max()), x_range=(0,1.05*x_data.max()), plot_width=600, plot_height=420,   sizing_mode="scale_both")
+plot.xgrid.visible = False
+plot.ygrid.visible = False
+plot.title.text = 'A dummy fitter'
+plot.title.align = "center"
+plot.title.text_color = "black"
+plot.title.text_font_size = "20px"
+
+# define widgets
+x_slider = Slider(start=0., end=10, value=x_i, step=0.25, title="x offset",width=plot.plot_width, sizing_mode="scale_width",format="0[.]0000", bar_color='khaki')
+y_slider = Slider(start=0., end=10, value=y_i, step=1.0, title="y offset",width=plot.plot_width, sizing_mode="scale_width", bar_color='khaki')
+select_menu = Select(title="Amplitude", value=a_init, options=amplitude_list, width=80)
+reset_button = Button(label='Reset', height=40, width=80)
+checkbox = CheckboxGroup(labels=period_list, active=[period_list.index(p_init)], width=50 )
+checkbox_label = Div(text='period', width= 50)
+
+# period -> line, created the first time the period is shown
+lines = {}
+
+
+def curve_data(p):
+    """data of the line of period p at the selected amplitude"""
+    xx, yy = curve(select_menu.value, p)
+    return dict(x_=xx, y_=yy)
+
+
+def update_lines(attr, old, new):
+    """shows the lines of the checked periods at the selected amplitude and hides the others"""
+    shown = [period_list[i] for i in checkbox.active]
+    for p, l in lines.items():
+        if p not in shown:
+            l.visible = False
+    for p in shown:
+        # the offsets are applied by transforms, one per line so that moving a slider only recomputes
+        # the visible lines. a line shown again gets the offsets the sliders were moved to meanwhile
+        if p in lines:
+            lines[p].glyph.x['transform'].value = x_slider.value
+            lines[p].glyph.y['transform'].value = y_slider.value
+            lines[p].data_source.data = curve_data(p)
+            lines[p].visible = True
+        else:
+            lines[p] = plot.line(transform('x_', Dodge(value=x_slider.value)),
+                                 transform('y_', Dodge(value=y_slider.value)),
+                                 source=ColumnDataSource(curve_data(p)), line_width=2., line_color='green',
+                                 tags=['model'])
+
+
+def reset():
+    checkbox.active = [period_list.index(p_init)]
+    select_menu.value = a_init
+    y_slider.value = y_i
+    x_slider.value = x_i
+
+
+checkbox.on_change('active', update_lines)
+select_menu.on_change('value', update_lines)
+# only the transforms of the visible lines are changed, and a change of a transform recomputes its line
+callback_slider = CustomJS(args=dict(plot=plot, slider1=x_slider, slider2=y_slider),
+                           code="""
+    for (const r of plot.renderers){
+        if (r.visible && r.tags.includes('model')){
+            r.glyph.x.transform.value = slider1.value;
+            r.glyph.y.transform.value = slider2.value;}
+    }
+    """)
+x_slider.js_on_change('value', callback_slider)
+y_slider.js_on_change('value', callback_slider)
+reset_button.on_click(reset)
+reset_button.js_on_click(CustomJS(args=dict(p=plot), code="p.reset.emit();"))
+update_lines('active', None, checkbox.active)
+
+#plot observations
+obs=plot.circle(x_data, y_data, color="black", level= 'underlay',size=1.5)
+show_obs_box = CheckboxButtonGroup(labels=['show obs.'], active=[0], width=40 )
+show_obs_callback = CustomJS(args=dict( obs_points=obs),
+                              code="""
+                    const s = cb_obj.active;
+                    if (s.includes(0)){obs_points.visible=true;}
+                    else{obs_points.visible=false;}""")
+
+show_obs_box.js_on_click( show_obs_callback)
+
+
+layout =  row( column(select_menu, checkbox_label, checkbox, reset_button,show_obs_box),
+              column(plot, row(column(x_slider, y_slider)),
+                     sizing_mode="scale_both"),sizing_mode="scale_both")
+
+doc = curdoc()
+doc.title = 'A dummy fitter'
+doc.add_root(layout)
@@ -0,0 +1,194 @@
+"""Chi-square fitting of a grid of model curves to the observations.
+
+fit_grid scores every model curve of a grid, at every x offset of a grid,
+against the observations. The models are interpolated at the shifted observed
+x through a sorted search of the model x (np.searchsorted), not by comparing
+every observation with every model point. Observations outside a shifted model
+count as residuals of a fixed chi-square each, so every fit is scored on all
+the observations. The y offset is solved for exactly:
+chi-square is quadratic in it, so the best one follows from three sums per
+model and x offset. When all models share one x (as the curves of model_grid
+do), the interpolation weights are the same for every model and the sums are
+matrix products of the model y with weights computed once per x offset. The
+models are scored in chunks, so memory stays below max_bytes however large
+the grid is, and with workers > 1 the chunks are scored in a process pool:
+
+    x, y = model_grid(amplitudes, periods)
+    fit = fit_grid(x, y, x_data, y_data, x_offsets=np.arange(0, 10, 0.01))
+    fit['best']
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# bytes of the temporary arrays of one chunk, per model x offset x observation (per model x offset
+# for models on a shared x)
+_BYTES_PER_ELEMENT = 48
+# chi-square of an observation outside a model, that of a 5 sigma residual
+OUTSIDE_CHI2 = 25.
+
+
+def locate(x, xq):
+    """finds xq on the sorted model x, x of shape (k, n): one row shared by all models or one row per
+        model. returns (i, t, inside), each of shape (k,) + xq.shape: xq lies between x[i-1] and x[i],
+        at the fraction t of the way, and inside is False where xq is outside the model"""
+    k, n = x.shape
+    inside = (xq >= x[:, :1].reshape((k,) + (1,) * xq.ndim)) & (xq <= x[:, -1:].reshape((k,) + (1,) * xq.ndim))
+    if k == 1:
+        i = np.searchsorted(x[0], xq)[None]
+    else:
+        # one search over all rows: row r is moved to [r * stride, r * stride + span], past the row before it
+        lo = x.min()
+        stride = (x.max() - lo) + 1.
+        offset = (np.arange(k) * stride).reshape((k,) + (1,) * xq.ndim)
+        q = np.clip(xq[None], x[:, :1].reshape(offset.shape), x[:, -1:].reshape(offset.shape)) - lo + offset
+        i = np.searchsorted((x - lo + offset.reshape(k, 1)).ravel(), q) - n * np.arange(k).reshape(offset.shape)
+    i = np.clip(i, 1, n - 1)
+    rows = np.arange(k).reshape((k,) + (1,) * xq.ndim)
+    x0 = x[rows, i - 1]
+    x1 = x[rows, i]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(x1 > x0, (xq - x0) / (x1 - x0), 0.)
+    return i, t, inside
+
+
+def shared_weights(x, x_obs, y_obs, w2, x_offsets):
+    """the interpolation weights of models on the shared x (n,) at every x offset (d,), such that for
+        model y the sums over the matched observations of w2, w2 * (y_obs - model) and
+        w2 * (y_obs - model)**2 are s0, s1 - y @ c1 and s2 - 2 * y @ c2 + y**2 @ q0 + 2 * y[:-1] * y[1:] @ q1.
+        every observation is interpolated from two neighbouring model points, so the quadratic term is
+        tridiagonal: q0 its diagonal, q1 the one above. returns OrderedDict(s0, s1, s2 (d,), c1, c2,
+        q0 (n, d), q1 (n - 1, d), points (d,))"""
+    n, d = len(x), len(x_offsets)
+    i, t, inside = locate(x[None], x_obs[None, :] - x_offsets[:, None])
+    i, t, inside = i[0], t[0], inside[0]
+    w = np.where(inside, w2, 0.)
+    lo, hi = w * (1. - t), w * t
+    # flat index of (model point, x offset) in arrays of shape (n, d)
+    column = np.arange(d)[:, None]
+    at_lo, at_hi = ((i - 1) * d + column).ravel(), (i * d + column).ravel()
+
+    def gather(weights_lo, weights_hi, size=n):
+        return (np.bincount(at_lo, weights_lo.ravel(), minlength=size * d)[:size * d] +
+                np.bincount(at_hi, weights_hi.ravel(), minlength=size * d)[:size * d]).reshape(size, d)
+    return OrderedDict([('s0', w.sum(-1)), ('s1', (w * y_obs).sum(-1)), ('s2', (w * y_obs * y_obs).sum(-1)),
+                        ('c1', gather(lo, hi)), ('c2', gather(lo * y_obs, hi * y_obs)),
+                        ('q0', gather(lo * (1. - t), hi * t)),
+                        ('q1', np.bincount(at_lo, (lo * t).ravel(), minlength=n * d)[:(n - 1) * d].reshape(n - 1, d)),
+                        ('points', inside.sum(-1))])
+
+
+def _best_y_offset(s0, s1, s2, y_bounds, points, min_points):
+    """chi-square at the best y offset, from the sums of w2, w2 * residual and w2 * residual**2"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dy = np.where(s0 > 0, s1 / s0, 0.)
+    if y_bounds is not None:
+        dy = np.clip(dy, y_bounds[0], y_bounds[1])
+    chi2 = np.maximum(s2 - 2. * dy * s1 + dy * dy * s0, 0.)
+    points = np.broadcast_to(points, chi2.shape)
+    chi2 = np.where(points >= min_points, chi2, np.inf)
+    return chi2, dy, points
+
+
+def _score_shared(y, weights, y_bounds, min_points):
+    """chi-square, best y offset and number of matched observations of the models y (m, n) on a shared x
+        at every x offset, from the weights returned by shared_weights. module level so it can run in a
+        worker process"""
+    s1 = weights['s1'] - y @ weights['c1']
+    s2 = weights['s2'] - 2. * (y @ weights['c2']) + (y * y) @ weights['q0'] + 2. * ((y[:, :-1] * y[:, 1:]) @ weights['q1'])
+    return _best_y_offset(weights['s0'], s1, s2, y_bounds, weights['points'], min_points)
+
+
+def _score_chunk(x, y, x_obs, y_obs, w2, x_offsets, y_bounds, min_points):
+    """chi-square, best y offset and number of matched observations of the models y (m, n), each on its
+        own row of x, at every x offset. module level so it can run in a worker process"""
+    xq = x_obs[None, :] - x_offsets[:, None]
+    i, t, inside = locate(x, xq)
+    rows = np.arange(len(y))[:, None, None]
+    d = y_obs - (y[rows, i - 1] * (1. - t) + y[rows, i] * t)
+    w = np.where(inside, w2, 0.)
+    dw = d * w
+    return _best_y_offset(w.sum(-1), dw.sum(-1), (dw * d).sum(-1), y_bounds, inside.sum(-1), min_points)
+
+
+def fit_grid(x, y, x_obs, y_obs, x_offsets, sigma=None, y_bounds=None, min_points=None, n_params=4,
+             outside_chi2=OUTSIDE_CHI2, max_bytes=256e6, workers=1):
+    """scores the model curves y against the observations at every x offset, the y offset of each
+        solved for. an observation is matched to a model by linear interpolation on the model x; an
+        observation outside the model adds outside_chi2 instead, so every fit is scored on all the
+        observations and shifting a model off part of them does not improve its score.
+        x: model x, sorted, (n,) shared by all models or (m, n) one row per model
+        y: model y, (m, n)
+        x_obs, y_obs: the observations, non-finite ones are left out
+        x_offsets: the x offsets tried, added to the models
+        sigma: optional error of y_obs, a number or one per observation
+        y_bounds: optional (low, high) the y offset is kept in, e.g. the range of its slider
+        min_points: models matching fewer observations at an x offset are not fitted there (chi2 inf).
+                    default: n_params + 1
+        n_params: fitted parameters, for the reduced chi-square of the best fit
+        outside_chi2: chi-square of an observation outside the model
+        max_bytes: bound of the temporary arrays of one chunk of models
+        workers: processes scoring chunks in parallel
+        returns an OrderedDict of x_offsets (d,) the offsets at which min_points observations can be
+        matched, chi2 (over all the observations), y_offset and points (m, d), and best, an OrderedDict
+        (model, x_offset, y_offset, chi2, points, unmatched, reduced_chi2) of the lowest chi-square, or
+        None if no model could be fitted. reduced_chi2 is chi2 / (observations - n_params)"""
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    if x.shape[1] != y.shape[1] or len(x) not in (1, len(y)):
+        raise ValueError('model x of shape %s does not match model y of shape %s' % (x.shape, y.shape))
+    if x.shape[1] < 2:
+        raise ValueError('model curves need at least 2 points')
+    x_obs = np.asarray(x_obs, dtype=float)
+    y_obs = np.asarray(y_obs, dtype=float)
+    w2 = np.broadcast_to(1. if sigma is None else 1. / np.asarray(sigma, dtype=float) ** 2, x_obs.shape)
+    good = np.isfinite(x_obs) & np.isfinite(y_obs) & np.isfinite(w2)
+    x_obs, y_obs, w2 = x_obs[good], y_obs[good], w2[good]
+    if min_points is None:
+        min_points = n_params + 1
+
+    # x offsets at which not even the full x range of all models matches min_points observations
+    # cannot fit any model
+    x_offsets = np.asarray(x_offsets, dtype=float)
+    shifted = x_obs[None, :] - x_offsets[:, None]
+    reach = ((shifted >= x[:, 0].min()) & (shifted <= x[:, -1].max())).sum(-1)
+    x_offsets = x_offsets[reach >= min_points]
+
+    m = len(y)
+    if len(x) == 1:
+        weights = shared_weights(x[0], x_obs, y_obs, w2, x_offsets)
+        chunk = int(max(1, max_bytes // (_BYTES_PER_ELEMENT * (len(x_offsets) + x.shape[1]))))
+        score = _score_shared
+        args = [(y[s:s + chunk], weights, y_bounds, min_points) for s in range(0, m, chunk)]
+    else:
+        chunk = int(max(1, max_bytes // (_BYTES_PER_ELEMENT * max(1, len(x_offsets) * len(x_obs)))))
+        score = _score_chunk
+        args = [(x[s:s + chunk], y[s:s + chunk], x_obs, y_obs, w2, x_offsets, y_bounds, min_points)
+                for s in range(0, m, chunk)]
+    if len(x_offsets) == 0:
+        results = []
+    elif workers > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(score, *a) for a in args]
+            results = [f.result() for f in futures]
+    else:
+        results = [score(*a) for a in args]
+    if results:
+        chi2, y_offset, points = (np.concatenate(r) for r in zip(*results))
+    else:
+        chi2 = y_offset = np.empty((m, 0))
+        points = np.empty((m, 0), dtype=int)
+    # the observations a model does not reach count as residuals too, so all fits are ranked on the same
+    # observations: a chi-square over only the matched ones would favour offsets that match fewer
+    chi2 = chi2 + outside_chi2 * (len(x_obs) - points)
+
+    best = None
+    if chi2.size and np.isfinite(chi2).any():
+        k, j = np.unravel_index(np.argmin(chi2), chi2.shape)
+        best = OrderedDict([('model', int(k)), ('x_offset', float(x_offsets[j])),
+                            ('y_offset', float(y_offset[k, j])), ('chi2', float(chi2[k, j])),
+                            ('points', int(points[k, j])), ('unmatched', len(x_obs) - int(points[k, j])),
+                            ('reduced_chi2', float(chi2[k, j]) / max(1, len(x_obs) - n_params))])
+    return OrderedDict([('x_offsets', x_offsets), ('chi2', chi2), ('y_offset', y_offset), ('points', points),
+                        ('best', best)])
@@ -8,44 +8,33 @@ import numpy as np
 import pandas as pd
 from collections import OrderedDict
 from bokeh.layouts import column, row
-from bokeh.models import CustomJS, Slider, CheckboxGroup,CheckboxButtonGroup, Div, Select, Button, LinearAxis, Label
+from bokeh.models import CustomJS, Slider, CheckboxGroup,CheckboxButtonGroup, Div, Select, Button, LinearAxis, Label, Dodge
 from bokeh.plotting import ColumnDataSource, figure, output_file, show
+from bokeh.transform import transform
+from model_curves import AMPLITUDES, PERIODS, Y_NOISE, model_curve, model_grid, observations
+from fitting import OUTSIDE_CHI2, fit_grid, locate
 
 
 
 #generate noisy sine curve 
 rng = np.random.default_rng()
-
-A= 4.5 #10*rng.random()
-T=  2.3 #5*rng.random()
-x_offset = 10*rng.random()
-y_offset = 10*rng.random()
-
-x0 = np.linspace(0,1,200)
-y0 = A* np.sin(x0*T*(2*np.pi))
-
-y_noise = 0.4 * rng.normal(size=x0.size)
-x_noise = 0.02 * rng.normal(size=x0.size)
-
-y_data= y0 + y_noise
-x_data = x0 + x_noise
-
-y_data = y_data+ y_offset
-x_data= x_data+ x_offset
+x_data, y_data = observations(rng)
+# sorted by x, so the observations inside a shifted model curve are found with two binary searches
+order = np.argsort(x_data)
+obs_source = ColumnDataSource(dict(x=x_data[order], y=y_data[order]))
 
 # generate sine curves 
-# lists of values must be strings to work with widgets 
-amplitude_list = ['2','4','6','8','10']
-period_list = ['1','2','3','4','5']
+# every curve of the grid is in the page; fit_app.py generates them on demand instead
+amplitude_list = AMPLITUDES
+period_list = PERIODS
 source_dict={}
 #create a dictionary of dictinaries.First key is amplitude value. then dictionary with keys of period value
 for a in amplitude_list:
     source_list=OrderedDict()
     for p in period_list:
-        xx=np.linspace(0,1,100)
-        yy = float(a) * np.sin(xx*float(p)*(2*np.pi))
-        df=pd.DataFrame({'x_':xx, 'y_':yy,'x_plot':xx, 'y_plot':yy})
-        source = ColumnDataSource(df[['y_','x_','y_plot','x_plot']])
+        xx, yy = model_curve(a, p)
+        df=pd.DataFrame({'x_':xx, 'y_':yy})
+        source = ColumnDataSource(df[['y_','x_']])
         source_list[p]=source
     source_dict[a]= source_list
 
@@ -63,6 +52,8 @@ plot.title.align = "center"
 plot.title.text_color = "black"
 plot.title.text_font_size = "20px"
 
+# the x and y offsets are applied to the lines when they are drawn, by transforms. every line has its
+# own, so moving a slider recomputes only the lines whose transforms it changes: the visible ones
 # plot all lines, setting some to visible and some to invisible
 lines={}
 for a in source_dict.keys():
@@ -73,7 +64,8 @@ for a in source_dict.keys():
             vis = True
         else:
             vis = False
-        l = plot.line('x_plot','y_plot', source=s, visible=vis,line_width=2., line_color='green')
+        l = plot.line(transform('x_', Dodge(value=x_i)), transform('y_', Dodge(value=y_i)), source=s, visible=vis,
+                      line_width=2., line_color='green')
         l.tags=[p]              
         lines_list.append(l)
         lines[a]=lines_list
@@ -88,11 +80,114 @@ show_obs_box = CheckboxButtonGroup(labels=['show obs.'], active=[0], width=40 )
 checkbox = CheckboxGroup(labels=period_list, active=[period_list.index(p_init)], width=50 )
 checkbox_label=Div(text='period', width= 50)
 
+# fit a dense amplitude x period x offset grid, much finer than the curves in the page, over the
+# ranges of the sliders
+fit_amplitudes = np.arange(1., 10.01, 0.1)
+fit_periods = np.arange(0.5, 5.001, 0.05)
+fit_x, fit_y = model_grid(fit_amplitudes, fit_periods)
+best = fit_grid(fit_x, fit_y, x_data, y_data, x_offsets=np.arange(x_slider.start, x_slider.end, 0.01),
+                sigma=Y_NOISE, y_bounds=(y_slider.start, y_slider.end))['best']
+if best is not None:
+    a_best = fit_amplitudes[best['model'] // len(fit_periods)]
+    p_best = fit_periods[best['model'] % len(fit_periods)]
+    xx, yy = model_curve(a_best, p_best)
+    best_line = plot.line(xx + best['x_offset'], yy + best['y_offset'], line_width=2., line_color='red',
+                          line_dash='dashed')
+    fit_div = Div(text='best fit: amplitude %.1f, period %.2f, x offset %.2f, y offset %.2f, '
+                       '&chi;<sup>2</sup>/dof %.2f (%s points outside the curve)' % (a_best, p_best, best['x_offset'],
+                                                                                    best['y_offset'],
+                                                                                    best['reduced_chi2'],
+                                                                                    best['unmatched']))
+else:
+    best_line = None
+    fit_div = Div(text='no model of the fit grid matches the observations')
+
+
+def residual_text(a, periods, dx, dy):
+    """the chi-square readout of the lines of amplitude a and the given periods at offsets dx, dy, as
+        show_residuals below writes it"""
+    rows = []
+    for p in periods:
+        xm, ym = source_dict[a][p].data['x_'], source_dict[a][p].data['y_']
+        i, t, inside = locate(np.asarray(xm)[None], x_data - dx)
+        i, t, inside = i[0], t[0], inside[0]
+        r = (y_data - (ym[i - 1] * (1. - t) + ym[i] * t + dy)) / Y_NOISE
+        outside = len(x_data) - inside.sum()
+        chi2 = (r[inside] ** 2).sum() + OUTSIDE_CHI2 * outside
+        rows.append('amplitude %s, period %s: &chi;<sup>2</sup>/dof %.2f (%d points outside the curve)'
+                    % (a, p, chi2 / max(1, len(x_data) - 4), outside))
+    return '<br>'.join(rows) if rows else 'no model curve shown'
+
+
+# the fit of the visible lines at the slider offsets, updated by the callbacks. the page starts with it
+# computed here, the callbacks only run once a widget is changed
+residual_div = Div(text=residual_text(a_init, [p_init], x_i, y_i))
+
 #setup callbacks 
 
+# the offsets of a line are only updated while it is visible, so one that is shown again first gets
+# the offsets the sliders were moved to while it was hidden. a transform whose value does not change
+# does not recompute the line
+set_visible = """
+    function set_visible(line, visible, dx, dy) {
+        if (visible) {
+            line.glyph.x.transform.value = dx;
+            line.glyph.y.transform.value = dy;}
+        line.visible = visible;
+    }
+"""
+
+# chi-square of the observations against every visible line at offsets dx, dy, as fitting.fit_grid
+# computes it: observations outside the line add outside_chi2 each, the others are compared to the line
+# interpolated at their x, found by binary search in the sorted x of the line. the observations are
+# sorted by x too, so only the ones inside the line are visited. all the observations count, so the
+# readout does not improve when a line is moved off them
+show_residuals = """
+    function search(xs, v, right) {
+        // first index with xs[i] >= v (right: xs[i] > v)
+        let lo = 0, hi = xs.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (xs[mid] < v || (right && xs[mid] == v)) {lo = mid + 1;}
+            else {hi = mid;}
+        }
+        return lo;
+    }
+    function show_residuals(lines, amplitude, obs, dx, dy, sigma, outside_chi2, div) {
+        const xo = obs.data['x'], yo = obs.data['y'];
+        const rows = [];
+        for (const l of lines) {
+            if (!l.visible) {continue;}
+            const xm = l.data_source.data['x_'], ym = l.data_source.data['y_'];
+            const n = xm.length;
+            const first = search(xo, xm[0] + dx, false), stop = search(xo, xm[n - 1] + dx, true);
+            let chi2 = 0.;
+            for (let i = first; i < stop; i++) {
+                const q = xo[i] - dx;
+                const j = Math.min(Math.max(search(xm, q, false), 1), n - 1);
+                const t = (q - xm[j - 1]) / (xm[j] - xm[j - 1]);
+                const r = (yo[i] - (ym[j - 1] + t * (ym[j] - ym[j - 1]) + dy)) / sigma;
+                chi2 += r * r;
+            }
+            const outside = xo.length - Math.max(stop - first, 0);
+            chi2 += outside_chi2 * outside;
+            rows.push('amplitude ' + amplitude + ', period ' + l.tags[0] + ': &chi;<sup>2</sup>/dof ' +
+                      (chi2 / Math.max(1, xo.length - 4)).toFixed(2) + ' (' + outside + ' points outside the curve)');
+        }
+        div.text = rows.length ? rows.join('<br>') : 'no model curve shown';
+    }
+"""
+residual_args = dict(obs=obs_source, x_slider=x_slider, y_slider=y_slider, sigma=Y_NOISE, outside_chi2=OUTSIDE_CHI2,
+                     residual_div=residual_div)
+residual_call = """
+    show_residuals(lines[select_menu.value], select_menu.value, obs, x_slider.value, y_slider.value, sigma, outside_chi2,
+                   residual_div);
+"""
+
 #for selecting different periods
-checkbox_callback = CustomJS(args=dict( select_menu=select_menu,lines=lines, value_list=amplitude_list, checkbox=checkbox),
-                              code="""
+checkbox_callback = CustomJS(args=dict( select_menu=select_menu,lines=lines, value_list=amplitude_list, checkbox=checkbox,
+                                        **residual_args),
+                              code=set_visible + show_residuals + """
     const t_new= select_menu.value;
     var a;
     var i;
@@ -100,10 +195,7 @@ checkbox_callback = CustomJS(args=dict( select_menu=select_menu,lines=lines, val
         const l=lines[a];
         if (a==t_new){
             for ( i =0; i < l.length; i++){
-                if (checkbox.active.includes(i)){
-                    l[i].visible = true;}
-                else{
-                    l[i].visible = false;}
+                set_visible(l[i], checkbox.active.includes(i), x_slider.value, y_slider.value);
             }
         }
         else{
@@ -112,41 +204,29 @@ checkbox_callback = CustomJS(args=dict( select_menu=select_menu,lines=lines, val
             }
         }
     }
-    """)
+    """ + residual_call)
 
 #for changing x and y offsets 
-callback_slider = CustomJS(args=dict(source_dict=source_dict,
-                              select_value_list=amplitude_list, slider1=x_slider, slider2= y_slider),
-                    code="""
-    const slider1_val = slider1.value;
-    const slider2_val = slider2.value;
-    var t;
-    var a;
-    for (a of select_value_list){
-        const line_to_plot = source_dict[a];
-        var v;
-        for (v in line_to_plot){
-            const s = line_to_plot[v];
-            const data = s.data;
-            const xx =data['x_plot'];
-            const yy = data['y_plot'];
-            for (var i = 0; i < xx.length; i++) {
-                xx[i]=data['x_'][i] + slider1_val ; 
-                yy[i]=data['y_'][i] + slider2_val ;
-            }
-            s.change.emit();
-        }
+# only the transforms of the visible lines, all of the selected amplitude, are changed, and a change of
+# a transform recomputes its line
+callback_slider = CustomJS(args=dict(lines=lines, select_menu=select_menu, **residual_args),
+                    code=show_residuals + """
+    for (const l of lines[select_menu.value]){
+        if (l.visible){
+            l.glyph.x.transform.value = x_slider.value;
+            l.glyph.y.transform.value = y_slider.value;}
     }
-    """)
+    """ + residual_call)
 
 
 # for selecting different amplitudes
-select_menu_callback= CustomJS(args=dict(source_dict=source_dict, lines=lines,
+select_menu_callback= CustomJS(args=dict(lines=lines,
                                          select_menu=select_menu, select_value_list=amplitude_list,
-                                         checkbox=checkbox),
-                            code="""
+                                         checkbox=checkbox, **residual_args),
+                            code=set_visible + show_residuals + """
     const t_new= select_menu.value;
     var a;
+    var i;
     const v_i= select_value_list;
     for (a of v_i){
         const s = lines[a];
@@ -156,20 +236,16 @@ select_menu_callback= CustomJS(args=dict(source_dict=source_dict, lines=lines,
     }
     
     const lines_active= lines[t_new];
-    var i;
     for ( i =0; i < lines_active.length; i++){
-        if (checkbox.active.includes(i)){
-            lines_active[i].visible = true;}
-        else{
-            lines_active[i].visible = false;}
+        set_visible(lines_active[i], checkbox.active.includes(i), x_slider.value, y_slider.value);
     }
-    """)
+    """ + residual_call)
 
 # for resetting plot 
 reset_call = CustomJS(args=dict(p=plot,s1=x_slider, s2= y_slider, x_val=x_i,y_val=y_i, 
 checkbox=checkbox, initial_checkbox= period_list.index(p_init), lines=lines, 
                                 select_menu=select_menu, select_val=a_init, select_value_list=amplitude_list ),
-                    code="""
+                    code=set_visible + """
         var a;
         var i;
         for (a of select_value_list){  
@@ -178,9 +254,9 @@ checkbox=checkbox, initial_checkbox= period_list.index(p_init), lines=lines,
         }
         checkbox.active=[initial_checkbox];
         select_menu.value= select_val;
-        lines[select_val][initial_checkbox].visible = true;
         s2.value = y_val;
         s1.value = x_val;
+        set_visible(lines[select_val][initial_checkbox], true, x_val, y_val);
         p.reset.emit();
         """)
 
@@ -193,7 +269,7 @@ reset_button.js_on_click( reset_call)
 
 
 #plot observations 
-obs=plot.circle(x_data, y_data, color="black", level= 'underlay',size=1.5)
+obs=plot.circle('x', 'y', source=obs_source, color="black", level= 'underlay',size=1.5)
 show_obs_box = CheckboxButtonGroup(labels=['show obs.'], active=[0], width=40 )
 show_obs_callback = CustomJS(args=dict( obs_points=obs),
                               code="""     
@@ -204,9 +280,15 @@ show_obs_callback = CustomJS(args=dict( obs_points=obs),
 
 show_obs_box.js_on_click( show_obs_callback)
 
+show_fit_box = CheckboxButtonGroup(labels=['show best fit'], active=[0], width=40, disabled=best_line is None)
+show_fit_callback = CustomJS(args=dict( fit_line=best_line),
+                              code="""
+                    if (fit_line != null){fit_line.visible = cb_obj.active.includes(0);}""")
+show_fit_box.js_on_click( show_fit_callback)
+
 
-layout =  row( column(select_menu, checkbox_label, checkbox, reset_button,show_obs_box),  
-              column(plot, row(column(x_slider, y_slider)),
+layout =  row( column(select_menu, checkbox_label, checkbox, reset_button,show_obs_box,show_fit_box),  
+              column(plot, row(column(x_slider, y_slider)), residual_div, fit_div,
                      sizing_mode="scale_both"),sizing_mode="scale_both")
 show(layout)
 
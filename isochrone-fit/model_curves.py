@@ -0,0 +1,70 @@
+"""Model curves and observations of the dummy fitter.
+
+The static page (make_example_plot.py) generates every curve of the grid up
+front. The server app (fit_app.py) only generates the curves that are shown,
+through cached_curves, which keeps the most recently used ones:
+
+    curve = cached_curves(maxsize=256)
+    x, y = curve('4', '2')
+    curve.cache_info()
+"""
+from functools import lru_cache
+
+import numpy as np
+
+# lists of values must be strings to work with widgets
+AMPLITUDES = ['2', '4', '6', '8', '10']
+PERIODS = ['1', '2', '3', '4', '5']
+N_POINTS = 100
+# standard deviation of the noise of the observations in y and x
+Y_NOISE = 0.4
+X_NOISE = 0.02
+
+
+def model_curve(amplitude, period, n=N_POINTS):
+    """x, y of the model curve of amplitude and period (numbers or their strings), n points"""
+    xx = np.linspace(0, 1, n)
+    yy = float(amplitude) * np.sin(xx * float(period) * (2 * np.pi))
+    return xx, yy
+
+
+def model_grid(amplitudes, periods, n=N_POINTS):
+    """the model curves of every amplitude x period combination in one array.
+        returns x (n,), shared by all curves, and y (len(amplitudes) * len(periods), n), amplitude major"""
+    xx = np.linspace(0, 1, n)
+    a = np.asarray(amplitudes, dtype=float)[:, None, None]
+    p = np.asarray(periods, dtype=float)[None, :, None]
+    yy = a * np.sin(xx * p * (2 * np.pi))
+    return xx, yy.reshape(-1, n)
+
+
+def cached_curves(maxsize=256, n=N_POINTS):
+    """model_curve of n points behind an LRU cache of the last maxsize curves. the cached arrays are
+        shared by every caller, so they are returned read-only"""
+    @lru_cache(maxsize=maxsize)
+    def curve(amplitude, period):
+        xx, yy = model_curve(amplitude, period, n)
+        xx.setflags(write=False)
+        yy.setflags(write=False)
+        return xx, yy
+    return curve
+
+
+def observations(rng, amplitude=4.5, period=2.3, n=200):
+    """noisy points of a sine curve of amplitude and period, shifted by random x and y offsets.
+        returns x_data, y_data"""
+    x_offset = 10 * rng.random()
+    y_offset = 10 * rng.random()
+
+    x0 = np.linspace(0, 1, n)
+    y0 = amplitude * np.sin(x0 * period * (2 * np.pi))
+
+    y_noise = Y_NOISE * rng.normal(size=x0.size)
+    x_noise = X_NOISE * rng.normal(size=x0.size)
+
+    y_data = y0 + y_noise
+    x_data = x0 + x_noise
+
+    y_data = y_data + y_offset
+    x_data = x_data + x_offset
+    return x_data, y_data
@@ -0,0 +1,31 @@
+import numpy as np
+
+from fitting import fit_grid
+from model_curves import Y_NOISE, model_grid, observations
+
+
+def test_recovers_known_offsets():
+    """a model curve shifted by known offsets is fitted back at them, whether its x is shared or per model"""
+    x, y = model_grid([4.5], [2.3], n=200)
+    x_obs, y_obs = x + 6.37, y[0] + 2.7
+    for model_x in (x, x[None]):
+        best = fit_grid(model_x, y, x_obs, y_obs, x_offsets=np.arange(0, 10, 0.01), sigma=Y_NOISE)['best']
+        assert abs(best['x_offset'] - 6.37) < 1e-6
+        assert abs(best['y_offset'] - 2.7) < 1e-6
+        assert best['unmatched'] == 0
+
+
+def test_partial_overlap_is_not_rewarded():
+    """the true model is fitted near its true offsets, not shifted off the noisy observations it matches
+        worst, and the dense grid of the example page finds it too"""
+    rng = np.random.default_rng(0)
+    x_offset, y_offset = 10 * np.random.default_rng(0).random(2)
+    x_obs, y_obs = observations(rng)
+    amplitudes, periods = np.arange(1., 10.01, 0.1), np.arange(0.5, 5.001, 0.05)
+    for a, p in (([4.5], [2.3]), (amplitudes, periods)):
+        x, y = model_grid(a, p)
+        best = fit_grid(x, y, x_obs, y_obs, x_offsets=np.arange(0, 10, 0.01), sigma=Y_NOISE,
+                        y_bounds=(0, 10))['best']
+        assert abs(best['x_offset'] - x_offset) < 0.02
+        assert abs(best['y_offset'] - y_offset) < 0.2
+        assert best['points'] > 0.95 * len(x_obs)
@@ -2,36 +2,451 @@
 #     when reset button pressed, reset view position of plot 
 # changelog - removed mesareader dependency
 #           - added round_num option to round data. if round_num is 99, no rounding is done
+#           - columns are kept as numpy arrays and embedded as base64 typed arrays; round_num is
+#             vectorized and dtype='float32' halves the embedded data. rounded columns are embedded
+#             as lists of short decimals, which are smaller (encoding)
+#           - glyphs draw the selected columns by name instead of x_data/y_data copies, and columns
+#             repeated across runs are stored once (dedupe)
+#           - a phase select zooms to an evolutionary phase, from event rows indexed when loading
+#           - bokeh and jinja2 are imported when a plot is built; page_data/build_layout split the data
+#             from the models and rebind refills a built plot with the data of other runs
 
-import os,sys,glob
+import os,sys,glob,gzip,base64,shutil,time,hashlib
+from contextlib import contextmanager
 import numpy as np
-import bokeh
 from collections import OrderedDict
-from bokeh.layouts import column, row
-from bokeh.models import CustomJS, CheckboxGroup,CheckboxButtonGroup,RadioGroup,Select, Div, Button, LinearAxis
-from bokeh.plotting import ColumnDataSource, figure, output_file, show, save
-from bokeh.embed import components
-from jinja2 import Template, Environment, BaseLoader
 from itertools import cycle
+from concurrent.futures import ProcessPoolExecutor
+from history_reader import read_history, read_header, drop_overwritten, HistoryFollower
+from history_cache import HistoryCache
+from downsample import lttb, minmax
+from expressions import compile_expressions, required_columns, evaluate_expressions
+from phases import EVENT_COLUMNS, find_events, phase_rows
+from stats import PlotStats
+
+
+# the javascript behind the axis, scale and reset widgets, as one module. make_plot puts it in a
+# single CustomJS model that the widget callbacks run once (see _JS_IMPORT) and then call into.
+#  - the glyphs draw the selected columns by name: an axis change switches the x/y fields of the
+#    glyphs instead of copying columns into x_data/y_data, so no column is in the page twice
+#  - load_column: with lazy_columns, only the default x/y columns are in the sources when the page
+#    loads (none with downsample, whose views hold the drawn points); the others are listed in the
+#    lazy source (source index, column name, url of the gzipped little-endian array, dtype) and are
+#    fetched and decoded the first time they are selected. needs DecompressionStream (all current
+#    browsers). columns moved out by dedupe_columns are rebuilt from the shared source the same way,
+#    referencing the rows they share with another source
+#  - scale_array: abs(log) and 10^ columns are computed once per column array into a Float64Array and
+#    kept; the scale transforms of the glyph fields and the downsampled/merged views all go through it
+#  - update_views: with downsample, every track has a store source (all rows) and a small view
+#    source (x_data, y_data) that is drawn. the views are refilled from the stores with
+#    largest-triangle-three-buckets, either over the whole track (after an axis change) or, when
+#    windowed, over the rows inside the visible ranges so zooming in restores detail
+#  - update_lod: refines the views after the ranges change. only a pan or zoom (a range the user
+#    changed) that leaves part of the drawn tracks out of view loads the full columns; the autorange
+#    when the page loads and a reset keep, or bring back, the views of whole tracks
+#  - split_runs/update_multi: with merge_tracks, the page holds only the concatenated columns. the
+#    lines of the multi_line are cut from the selected ones by the transforms of its xs/ys, as
+#    subarray views, so no second copy of x/y is in the page and one buffer per axis is touched for
+#    all runs. update_multi points the transforms at other columns
+#  - request_update: applies the current widget state to all sources, with one change per glyph
+#    for both axes. requests made in the same tick (e.g. a select that also resets its scale radio
+#    group) are merged into one update
+#  - show_phase: zooms to the rows of one evolutionary phase, looked up in the phase index (source,
+#    phase, first row, stop row) built in python, so no track is searched for the phase in the page
+_JS_MODULE = """
+function find_row(index, i, name) {
+    if (index == null) {
+        return -1;}
+    const d = index.data;
+    for (var k = 0; k < d['column'].length; k++) {
+        if (d['source'][k] == i && d['column'][k] == name) {
+            return k;}
+    }
+    return -1;
+}
+const typed_cache = new WeakMap();
+function typed(v) {
+    // columns embedded as lists (encoding 'list') are copied into a Float64Array once, for subarray
+    if (v == null || ArrayBuffer.isView(v)) {
+        return v;}
+    var t = typed_cache.get(v);
+    if (t == null) {
+        t = Float64Array.from(v);
+        typed_cache.set(v, t);}
+    return t;
+}
+function rebuild(base, prefix, length, tail) {
+    // the first prefix rows of base followed by tail or, without base, tail[0] repeated
+    base = typed(base);
+    if (base != null && prefix == length) {
+        return base.subarray(0, length);}
+    const Type = (base != null) ? base.constructor : (ArrayBuffer.isView(tail) ? tail.constructor : Float64Array);
+    const out = new Type(length);
+    if (base == null) {
+        out.fill(tail[0]);
+    } else {
+        out.set(base.subarray(0, prefix));
+        out.set(tail, prefix);
+    }
+    return out;
+}
+function load_column(source_list, i, name, lazy, shared) {
+    const source = source_list[i];
+    if (name in source.data) {
+        return Promise.resolve();}
+    if (source._pending == null) {
+        source._pending = {};}
+    if (!(name in source._pending)) {
+        const k = find_row(shared, i, name);
+        const l = find_row(lazy, i, name);
+        if (k >= 0) {
+            const d = shared.data;
+            const owner = d['owner'][k];
+            const base = (owner >= 0) ? load_column(source_list, owner, name, lazy, shared) : Promise.resolve();
+            source._pending[name] = base.then(() => {
+                const base_column = (owner >= 0) ? source_list[owner].data[name] : null;
+                source.data[name] = rebuild(base_column, d['prefix'][k], d['length'][k], d['tail'][k]);});
+        } else if (l >= 0) {
+            const d = lazy.data;
+            source._pending[name] = fetch(d['url'][l])
+                .then(r => new Response(r.body.pipeThrough(new DecompressionStream('gzip'))).arrayBuffer())
+                .then(buf => {
+                    source.data[name] = (d['dtype'][l] == 'float32') ? new Float32Array(buf) : new Float64Array(buf);});
+        } else {
+            return Promise.resolve();}
+    }
+    return source._pending[name];
+}
+function load_columns(source_list, name, lazy, shared) {
+    return Promise.all(source_list.map((s, i) => load_column(source_list, i, name, lazy, shared)));
+}
+
+const scaled_cache = new WeakMap();
+function scale_array(v, scale) {
+    if (scale == 0) {
+        return v;}
+    var entry = scaled_cache.get(v);
+    // streaming with a rollover shifts a full column in place (follow mode), so the scaled
+    // columns are only reused while the length and last value of the column are unchanged
+    const last = v[v.length - 1];
+    if (entry == null || entry.length != v.length || !Object.is(entry.last, last)) {
+        entry = {length: v.length, last: last};
+        scaled_cache.set(v, entry);
+    }
+    if (entry[scale] == null) {
+        const out = new Float64Array(v.length);
+        if (scale == 1) {
+            for (var i = 0; i < v.length; i++) {out[i] = Math.log10(Math.abs(v[i]));}
+        } else {
+            for (var i = 0; i < v.length; i++) {out[i] = 10**v[i];}
+        }
+        entry[scale] = out;
+    }
+    return entry[scale];
+}
+function field_spec(name, scale, transforms) {
+    if (scale == 0) {
+        return {field: name};}
+    return {field: name, transform: transforms[scale - 1]};
+}
+function axis_label(name, scale) {
+    if (scale == 1) {
+        return 'log(' + name + ')';}
+    if (scale == 2) {
+        return '10^' + name;}
+    return name;
+}
+
+function lttb(x, y, idx, n) {
+    const size = idx.length;
+    if (n >= size || n < 3) {
+        return idx;}
+    const out = new Int32Array(n);
+    out[0] = idx[0];
+    out[n - 1] = idx[size - 1];
+    const every = (size - 2) / (n - 2);
+    var a = idx[0];
+    for (var i = 0; i < n - 2; i++) {
+        const lo = Math.floor(i * every) + 1;
+        const hi = Math.floor((i + 1) * every) + 1;
+        const n_hi = Math.min(Math.floor((i + 2) * every) + 1, size);
+        var cx = 0, cy = 0;
+        for (var j = hi; j < n_hi; j++) {
+            cx += x[idx[j]];
+            cy += y[idx[j]];}
+        cx = (n_hi > hi) ? cx / (n_hi - hi) : x[idx[size - 1]];
+        cy = (n_hi > hi) ? cy / (n_hi - hi) : y[idx[size - 1]];
+        var best = -1, chosen = idx[lo];
+        for (var j = lo; j < hi; j++) {
+            const k = idx[j];
+            const area = Math.abs((x[a] - cx) * (y[k] - y[a]) - (x[a] - x[k]) * (cy - y[a]));
+            if (area > best) {
+                best = area;
+                chosen = k;}
+        }
+        a = chosen;
+        out[i + 1] = a;
+    }
+    return out;
+}
+function update_views(a, windowed) {
+    const plot = a.plot;
+    if (a.lod_n == 0) {
+        return;}
+    plot._imp_windowed = windowed;
+    const x0 = Math.min(plot.x_range.start, plot.x_range.end);
+    const x1 = Math.max(plot.x_range.start, plot.x_range.end);
+    const y0 = Math.min(plot.y_range.start, plot.y_range.end);
+    const y1 = Math.max(plot.y_range.start, plot.y_range.end);
+    for (var k = 0; k < a.source_list.length; k++) {
+        const s = a.source_list[k];
+        const x = scale_array(s.data[a.x_select.value], a.x_scale.active);
+        const y = scale_array(s.data[a.y_select.value], a.y_scale.active);
+        // rows inside the window plus their neighbours, so lines leaving the window are kept
+        const keep = new Uint8Array(x.length);
+        for (var i = 0; i < x.length; i++) {
+            if (!windowed || (x[i] >= x0 && x[i] <= x1 && y[i] >= y0 && y[i] <= y1)) {
+                keep[i] = 1;
+                if (i > 0) {keep[i - 1] = 1;}
+                if (i < x.length - 1) {keep[i + 1] = 1;}
+            }
+        }
+        const idx = [];
+        for (var i = 0; i < x.length; i++) {
+            if (keep[i]) {idx.push(i);}}
+        const sel = lttb(x, y, idx, a.lod_n);
+        a.view_list[k].data = {'x_data': Float64Array.from(sel, i => x[i]),
+                               'y_data': Float64Array.from(sel, i => y[i])};
+    }
+}
+function drawn_extent(a) {
+    // bounds of the points drawn by the views
+    var x0 = Infinity, x1 = -Infinity, y0 = Infinity, y1 = -Infinity;
+    for (const v of a.view_list) {
+        const x = v.data['x_data'], y = v.data['y_data'];
+        for (var i = 0; i < x.length; i++) {
+            if (isFinite(x[i]) && isFinite(y[i])) {
+                x0 = Math.min(x0, x[i]);
+                x1 = Math.max(x1, x[i]);
+                y0 = Math.min(y0, y[i]);
+                y1 = Math.max(y1, y[i]);}
+        }
+    }
+    return [x0, x1, y0, y1];
+}
+function update_lod(a) {
+    const plot = a.plot;
+    // the views of whole tracks are what is zoomed into; windowed views only show part of them
+    if (!plot._imp_windowed) {
+        plot._imp_extent = drawn_extent(a);}
+    const [e_x0, e_x1, e_y0, e_y1] = plot._imp_extent;
+    const x0 = Math.min(plot.x_range.start, plot.x_range.end);
+    const x1 = Math.max(plot.x_range.start, plot.x_range.end);
+    const y0 = Math.min(plot.y_range.start, plot.y_range.end);
+    const y1 = Math.max(plot.y_range.start, plot.y_range.end);
+    // BokehJS sets have_updated_interactively on a pan or zoom, not when it autoranges or resets
+    const user = plot.x_range.have_updated_interactively || plot.y_range.have_updated_interactively;
+    if (user && (x0 > e_x0 || x1 < e_x1 || y0 > e_y0 || y1 < e_y1)) {
+        return load_selected(a).then(() => update_views(a, true));}
+    if (plot._imp_windowed) {
+        // the columns were loaded when the views were windowed
+        update_views(a, false);}
+    return Promise.resolve();
+}
+
+function split_runs(runs, store, name, scale, offsets) {
+    // the lines of the runs of the multi_line, views into the concatenated column name
+    const v = typed(scale_array(store.data[name], scale));
+    return Array.from(runs, r => v.subarray(offsets[r], offsets[r + 1]));
+}
+function update_multi(a) {
+    // the xs/ys transforms are set silently, so the lines are recomputed once, by the source change
+    const [tx, ty] = a.multi_transforms;
+    tx.setv({args: Object.assign({}, tx.args, {name: a.x_select.value, scale: a.x_scale.active})}, {silent: true});
+    ty.setv({args: Object.assign({}, ty.args, {name: a.y_select.value, scale: a.y_scale.active})}, {silent: true});
+    a.multi.change.emit();
+}
+
+function update_axes(a, flip) {
+    const x_name = a.x_select.value;
+    const y_name = a.y_select.value;
+    const x_scale = a.x_scale.active;
+    const y_scale = a.y_scale.active;
+    a.axx[1].axis_label = axis_label(x_name, x_scale);
+    a.axy[0].axis_label = axis_label(y_name, y_scale);
+    if (flip) {
+        //flip x-axis for HRD
+        a.plot.x_range.flipped = (x_name == 'log_Teff' && y_name == 'log_L');}
+    const x_field = field_spec(x_name, x_scale, a.transforms);
+    const y_field = field_spec(y_name, y_scale, a.transforms);
+    for (const r of a.renderers) {
+        r.glyph.setv({x: x_field, y: y_field});}
+    if (a.multi != null) {
+        update_multi(a);}
+    if (a.lod_n > 0) {
+        update_views(a, false);}
+    if (a.phase_select != null && a.phase_select.value != 'all') {
+        show_phase(a, a.phase_select.value);}
+}
+function set_range(range, lo, hi) {
+    const pad = (hi > lo) ? 0.05 * (hi - lo) : Math.max(0.05 * Math.abs(lo), 1e-10);
+    // keeps the data range from auto ranging over the new bounds on the next data change
+    range.have_updated_interactively = true;
+    if (range.flipped) {
+        range.setv({start: hi + pad, end: lo - pad});
+    } else {
+        range.setv({start: lo - pad, end: hi + pad});}
+}
+function show_phase(a, phase) {
+    if (phase == 'all' || a.phases == null) {
+        a.plot.reset.emit();
+        return;}
+    const d = a.phases.data;
+    var x0 = Infinity, x1 = -Infinity, y0 = Infinity, y1 = -Infinity;
+    for (var k = 0; k < d['phase'].length; k++) {
+        if (d['phase'][k] != phase) {
+            continue;}
+        const s = a.source_list[d['source'][k]];
+        const x = scale_array(s.data[a.x_select.value], a.x_scale.active);
+        const y = scale_array(s.data[a.y_select.value], a.y_scale.active);
+        for (var i = d['start'][k]; i < d['stop'][k]; i++) {
+            if (isFinite(x[i]) && isFinite(y[i])) {
+                x0 = Math.min(x0, x[i]);
+                x1 = Math.max(x1, x[i]);
+                y0 = Math.min(y0, y[i]);
+                y1 = Math.max(y1, y[i]);}
+        }
+    }
+    // no track reaches the phase with finite values on these axes
+    if (!(x0 <= x1 && y0 <= y1)) {
+        return;}
+    set_range(a.plot.x_range, x0, x1);
+    set_range(a.plot.y_range, y0, y1);
+}
+function load_selected(a) {
+    // the columns of the selected axes, in the sources once their lazy chunks are decoded
+    const names = [a.x_select.value, a.y_select.value];
+    return Promise.all(names.map(name => load_columns(a.source_list, name, a.lazy, a.shared)));
+}
+function request_update(a, flip) {
+    const state = a.plot;
+    state._imp_flip = state._imp_flip || flip;
+    if (state._imp_scheduled) {
+        return;}
+    state._imp_scheduled = true;
+    Promise.resolve().then(() => load_selected(a)).then(() => {
+        const flip_now = state._imp_flip;
+        state._imp_scheduled = false;
+        state._imp_flip = false;
+        update_axes(a, flip_now);
+    });
+}
+
+return {load_columns: load_columns, load_selected: load_selected, scale_array: scale_array, lttb: lttb,
+        split_runs: split_runs, update_views: update_views, update_lod: update_lod, request_update: request_update,
+        show_phase: show_phase};
+"""
+
+# first lines of every callback that uses the module: runs the module once per page and keeps its functions
+_JS_IMPORT = """
+const IMP = module._exports || (module._exports = module.execute(null));
+"""
+
+
+def bokeh_js_bundles(webgl=False):
+    """names of the BokehJS bundles a page needs"""
+    bundles = ['bokeh', 'bokeh-widgets']
+    if webgl:
+        bundles.append('bokeh-gl')
+    return bundles
+
+
+def write_bokeh_resources(directory):
+    """copies the BokehJS bundles into directory, so that many pages can share one cached copy
+        (see save_plot resources_url). returns the paths of the written files"""
+    import bokeh
+    from bokeh.util.paths import bokehjsdir
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for b in bokeh_js_bundles(webgl=True):
+        src = os.path.join(bokehjsdir(), 'js', '%s.min.js' % b)
+        dst = os.path.join(directory, '%s-%s.min.js' % (b, bokeh.__version__))
+        if not os.path.isfile(dst):
+            shutil.copyfile(src, dst)
+        written.append(dst)
+    return written
+
+
+# rows a column has to share with the column of the same name in another run to be deduplicated
+MIN_SHARED_ROWS = 16
+
+
+def round_sig(values, digits):
+    """rounds an array to the given number of significant digits in one vectorized pass"""
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponent = np.floor(np.log10(np.abs(values)))
+    # zeros, nan, inf and values too extreme for a finite scale factor are left as they are
+    exponent = np.nan_to_num(exponent, nan=0., posinf=0., neginf=0.)
+    extreme = np.abs(exponent) > 290
+    k = digits - 1 - np.where(extreme, 0., exponent)
+    # powers of ten are exact for 0 <= k <= 22: dividing or multiplying the rounded integer by one
+    # gives the double nearest to the decimal, which is embedded with the fewest digits
+    up, down = 10.0**np.maximum(k, 0), 10.0**np.maximum(-k, 0)
+    return np.where(extreme, values, np.round(values * up / down) / up * down)
+
+
+def _read_history_file(args):
+    """parses one history file in a worker process. module level so it can be pickled"""
+    file, qual_list, cache_dir, rows, derived = args
+    # compiled here, code objects cannot be pickled
+    expressions = compile_expressions(derived)
+    if cache_dir is not None:
+        return HistoryCache(cache_dir).read_history(file, columns=qual_list, rows=rows, expressions=expressions)
+    header, data = read_history(file, columns=qual_list, rows=rows)
+    data.update(evaluate_expressions(expressions, data))
+    return header, data
 
 
 class iMESAplotter:
-    def __init__(self,directory,mode='single', history_file_name= 'history.data', history_files=None, round_num=99):
+    def __init__(self,directory,mode='single', history_file_name= 'history.data', history_files=None, round_num=99,
+                 cache_dir=None, workers=1, dtype=None, follow=False, stats_callback=None, encoding=None):
         self.mode= mode
+        # number of decimals kept in exponent notation (i.e. round_num+1 significant digits). 99: no rounding
         self.round_num = round_num
-        if mode=='single':
-            self.dir = directory
-            self.history_files=glob.glob(os.path.join(self.dir,'**/%s'%history_file_name))
-        elif mode=='binary':
-            self.dir = directory
-            self.history_files=glob.glob(os.path.join(self.dir,'**/%s'%history_file_name))
-            self.binary_history = os.path.join(self.dir, 'binary_history.data')
-        elif mode=='multiple' :
-            self.history_files=[]
-            for d in directory:
-                self.history_files+=glob.glob(os.path.join(d,'**/%s'%history_file_name))
-        elif history_files is not None:
+        # dtype of the embedded columns, e.g. 'float32' to halve the size of the saved page
+        self.dtype = dtype
+        # how the columns are embedded: 'binary' as base64 typed arrays, 'list' as json lists of numbers.
+        # None: lists when round_num is set (a rounded number is shorter written out than its 8 bytes
+        # in base64), binary otherwise
+        if encoding is None:
+            encoding = 'list' if round_num != 99 and dtype is None else 'binary'
+        if encoding not in ('binary', 'list'):
+            raise ValueError("encoding must be 'binary' or 'list', not %r" % (encoding,))
+        self.encoding = encoding
+        # number of processes used to parse history files
+        self.workers = workers
+        # optional on-disk cache of parsed history files, so re-renders only parse new or changed runs
+        if cache_dir is not None:
+            self.cache = HistoryCache(cache_dir)
+        else:
+            self.cache = None
+        # with follow, history files are read through followers that remember how far they have been
+        # read, so that stream_new_rows only parses rows MESA appended since (see follow_app.py)
+        self.followers = {} if follow else None
+        # compiled derived quantities (see expressions.py), set by load_history_files
+        self.expressions = []
+        # per history file, an OrderedDict of event -> row (see phases.py), set by load_history_files
+        self.events = []
+        # timings and sizes of the last page (see stats.py), and an optional function called with
+        # them when the page is saved
+        self.stats = PlotStats()
+        self.stats_callback = stats_callback
+        self.history_file_name = history_file_name
+        if history_files is not None and mode not in ('single', 'binary', 'multiple'):
             self.history_files= history_files
+        else:
+            self._set_history_files(directory)
         self.html_template="""<!DOCTYPE html>
                                 <html lang="en">
                                     <head>
@@ -45,10 +460,9 @@ class iMESAplotter:
                                     </style>-->
                                         <meta charset="utf-8">
                                         <title>{{page_title}}</title>
-                                    <script src="https://cdn.bokeh.org/bokeh/release/bokeh-{{bokeh_version}}.min.js"
-                                        crossorigin="anonymous"></script>
-                                    <script src="https://cdn.bokeh.org/bokeh/release/bokeh-widgets-{{bokeh_version}}.min.js"
-                                        crossorigin="anonymous"></script>
+                                    {% for js_file in js_files %}
+                                    <script src="{{js_file}}" crossorigin="anonymous"></script>
+                                    {% endfor %}
                                         {{script}}
                                     </head>
                                     <body>
@@ -58,46 +472,64 @@ class iMESAplotter:
                                     <p>{{text}}</p>
                                     </body>
                                 </html> """
-        self.template= Environment(loader=BaseLoader()).from_string(self.html_template)
+        # compiled from html_template when the first page is rendered
+        self.template = None
+        self._serialized = None
+
+    def _set_history_files(self, directory):
+        """finds the history files of the run(s) in directory (a list of directories for mode multiple)"""
+        history_file_name = self.history_file_name
+        if self.mode=='single':
+            self.dir = directory
+            self.history_files=glob.glob(os.path.join(self.dir,'**/%s'%history_file_name))
+        elif self.mode=='binary':
+            self.dir = directory
+            self.history_files=glob.glob(os.path.join(self.dir,'**/%s'%history_file_name))
+            self.binary_history = os.path.join(self.dir, 'binary_history.data')
+        elif self.mode=='multiple' :
+            self.history_files=[]
+            for d in directory:
+                self.history_files+=glob.glob(os.path.join(d,'**/%s'%history_file_name))
 
     def load_html_template(self,file):
         """loads a custom html template from file"""
+        from jinja2 import Template
         with open(file) as f:
             self.template = Template(f.read())
         
-    def load_data(self,file, qual_list=None,x_qual=None, y_qual=None):
+    def read_data(self, file, qual_list=None, rows=None, expressions=None):
+        """parses a MESA log file (through the cache if there is one) without building any Bokeh objects.
+            rows: optional history_reader.RowFilter selecting the rows to keep (not in follow mode)
+            expressions: optional list of compiled derived quantities, added after the columns
+            returns (header, data) where data maps column name -> array"""
+        expressions = expressions or []
+        if self.followers is not None:
+            follower = self.followers.setdefault(file, HistoryFollower(file, qual_list))
+            data, restarted = follower.read()
+            if 'model_number' in data:
+                keep = drop_overwritten(data['model_number'])
+                data = OrderedDict((c, v[keep]) for c, v in data.items())
+            header = follower.header
+        elif self.cache is not None:
+            return self.cache.read_history(file, columns=qual_list, rows=rows, expressions=expressions)
+        else:
+            header, data = read_history(file, columns=qual_list, rows=rows)
+        # no columns if the header of a followed file is not written yet
+        if data:
+            data.update(evaluate_expressions(expressions, data))
+        return header, data
+
+    def load_data(self,file, qual_list=None,x_qual=None, y_qual=None, parsed=None):
         """loads data from MESA log file into Bokeh Column DataSource object. 
-            also gets column names and sets data to display"""
-        bulk_names_line = 6
-        header_names_line = 2
-        bulk_data = np.genfromtxt( file, skip_header=bulk_names_line - 1, names=True, dtype=None)
-        bulk_names = bulk_data.dtype.names
-        header_data = []
-        with open(file) as f:
-            for i, line in enumerate(f):
-                if i == header_names_line - 1:
-                    header_names = line.split()
-                elif i == header_names_line:
-                    header_data = [eval(datum) for datum in line.split()]
-                elif i > header_names_line:
-                    break
-        header_data = dict(zip(header_names, header_data))
-
-       
-        if qual_list is None:
-            qual_list = list(bulk_names)
-            
-            
-        # round data to make smaller output file
-        frmt_str = '{:0.%se}'%self.round_num
-        dat_dict=OrderedDict()
-        for q in qual_list:
-            if self.round_num != 99:
-                data_rounded = [float(frmt_str.format(p)) for p in bulk_data[q]]
-                dat_dict[q] =data_rounded
-            else:
-                dat_dict[q] = bulk_data[q]
+            also gets column names and sets data to display.
+            parsed: optional (header, data) already returned by read_data for this file"""
+        from bokeh.models import ColumnDataSource
+        if parsed is None:
+            parsed = self.read_data(file, qual_list)
+        header_data, bulk_data = parsed
 
+        dat_dict = self.table(bulk_data, qual_list)
+        qual_list = list(dat_dict)
 
         if x_qual is None:
             x_qual=qual_list[0]
@@ -107,16 +539,87 @@ class iMESAplotter:
         source = ColumnDataSource(dat_dict )
         return [source, qual_list, x_qual, y_qual, header_data]
     
-    def load_history_files(self, qual_list=None,x_qual=None, y_qual=None):
-        datas=[]
+    def table(self, bulk_data, qual_list=None):
+        """the columns qual_list (all if None) of parsed data that are in it, rounded/downcast to make
+            a smaller output file. columns stay numpy arrays, which Bokeh embeds as base64 typed
+            arrays rather than lists of numbers"""
+        if qual_list is None:
+            qual_list = list(bulk_data)
+        return OrderedDict((q, self.compact(bulk_data[q])) for q in qual_list if q in bulk_data)
+
+    def compact(self, values):
+        """applies round_num and dtype to a data column"""
+        if self.round_num != 99:
+            values = round_sig(values, self.round_num + 1)
+        if self.dtype is not None:
+            with np.errstate(over='ignore'):
+                small = np.asarray(values, dtype=self.dtype)
+            # columns with values out of range for dtype (e.g. J_orb in float32) are not downcast
+            if np.isfinite(small).sum() == np.isfinite(values).sum():
+                values = small
+        return values
+
+    def embed(self, table):
+        """table with its columns as they are put in the page: with encoding 'list', numeric columns
+            become lists of numbers. json has no nan or inf, columns holding them stay typed arrays"""
+        if self.encoding != 'list' or table is None:
+            return table
+        out = OrderedDict()
+        for q, v in table.items():
+            if isinstance(v, np.ndarray) and v.dtype.kind in 'biuf' and np.isfinite(v).all():
+                v = v.tolist()
+            out[q] = v
+        return out
+
+    def load_history_files(self, qual_list=None,x_qual=None, y_qual=None, workers=None, rows=None, derived=None,
+                           events=True):
+        """read_history_files, with the tables returned as Bokeh ColumnDataSources"""
+        from bokeh.models import ColumnDataSource
+        tables, qual_list, x_qual, y_qual = self.read_history_files(qual_list, x_qual, y_qual, workers, rows,
+                                                                    derived, events)
+        return [[ColumnDataSource(t) for t in tables], qual_list, x_qual, y_qual]
+
+    def read_history_files(self, qual_list=None,x_qual=None, y_qual=None, workers=None, rows=None, derived=None,
+                           events=True):
+        """loads all history files in two passes: the headers of all files are read first to find
+            the columns they have in common, then only those columns are parsed. with workers > 1 the
+            files are parsed in a process pool; results keep the order of self.history_files.
+            rows: optional history_reader.RowFilter, applied while the files are parsed
+            derived: optional mapping of name -> expression of derived quantities, added after the columns
+            events: also read the columns evolutionary events are found from and index the events of
+                    every file into self.events (see phases.py)
+            returns [tables, qual_list, x_qual, y_qual], where tables holds an OrderedDict of column ->
+            array per file. no Bokeh models are built
+            (on platforms that spawn processes, call this from under if __name__ == '__main__')"""
+        if workers is None:
+            workers = self.workers
+        if self.followers is not None:
+            if rows is not None:
+                raise ValueError('rows cannot be filtered in follow mode')
+            # start following from the beginning; followers only live in this process
+            self.followers = {}
+            workers = 1
+
+        derived = derived or {}
+        self.expressions = compile_expressions(derived)
+        inputs = required_columns(self.expressions)
+
+        # first pass: the column names of every file, from the headers only
+        qual_lists = []
+        event_columns = list(EVENT_COLUMNS) if events else []
         for h in self.history_files:
-            dat = self.load_data(h, qual_list, x_qual,y_qual)
-            datas.append(dat)
-            
-        source_list=[x[0] for x in datas]
-        qual_lists = [x[1] for x in datas]
-        x_quals=[x[2] for x in datas]
-        y_quals=[x[3] for x in datas]
+            names = read_header(h)[1]
+            event_columns = [c for c in event_columns if c in names]
+            missing = [c for c in inputs if c not in names]
+            if missing:
+                raise ValueError('%s has no column %s used by the derived quantities' % (h, ', '.join(missing)))
+            taken = [d for d in derived if d in names]
+            if taken:
+                raise ValueError('derived quantity %s has the name of a column of %s' % (', '.join(taken), h))
+            quals = names if qual_list is None else [q for q in qual_list if q in names]
+            qual_lists.append(quals + list(derived))
+        x_quals=[l[0] for l in qual_lists]
+        y_quals=[l[1] for l in qual_lists]
         
         if not all(l ==qual_lists[0] for l in qual_lists):# if lists are not the same
             #get common elements in lists
@@ -142,28 +645,205 @@ class iMESAplotter:
         if not all(y_qual in sublist for sublist in qual_lists):
             print('Setting y quantity to %s!'%qual_list[1])
             y_qual=qual_list[1]
-        for s in source_list:
-            s.data['x_data'] = s.data[x_qual]
-            s.data['y_data']=s.data[y_qual]
-        return [source_list, qual_list,x_qual, y_qual]
+
+        # whether each file will come from the cache, checked before it is parsed (and possibly stored)
+        cache_hits = [self.cache.is_fresh(h) if self.cache is not None and self.followers is None else None
+                      for h in self.history_files]
+
+        # second pass: only the common columns and the ones the derived quantities need
+        columns = [q for q in qual_list if q not in derived]
+        columns += [c for c in inputs + event_columns if c not in columns]
+        if workers > 1 and len(self.history_files) > 1:
+            cache_dir = self.cache.dir if self.cache is not None else None
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parsed = list(pool.map(_read_history_file,
+                                       [(h, columns, cache_dir, rows, derived) for h in self.history_files]))
+        else:
+            parsed = [self.read_data(h, columns, rows, self.expressions) for h in self.history_files]
+
+        tables = [self.table(p[1], qual_list) for p in parsed]
+        self.events = [self.find_events(h, p[1]) for h, p in zip(self.history_files, parsed)] if events else []
+        self.stats.files = [OrderedDict([('file', h), ('rows', len(next(iter(p[1].values()))) if p[1] else 0),
+                                         ('columns', len(p[1])), ('cache_hit', hit)])
+                            for h, p, hit in zip(self.history_files, parsed, cache_hits)]
+        return [tables, qual_list,x_qual, y_qual]
     
+    def find_events(self, file, data):
+        """indexes the evolutionary events of the track parsed from history file file (see phases.py).
+            in binary mode the star is told by the directory of the file (LOGS1 or LOGS2), and the
+            overflow is taken from binary_history.data if the history file does not log it"""
+        star = 2 if os.path.basename(os.path.dirname(file)).endswith('2') else 1
+        binary = None
+        if self.mode == 'binary' and 'rl_relative_overflow_%s' % star not in data \
+                and os.path.isfile(self.binary_history):
+            binary = read_history(self.binary_history,
+                                  columns=['model_number', 'rl_relative_overflow_%s' % star])[1]
+        return find_events(data, star=star, binary=binary)
+
+    def phase_index(self, tables, offsets=None):
+        """returns a table of the row ranges of the phases of every track (source, phase, first row,
+            stop row), or None if no track has any. offsets: row offsets of the runs when the tracks
+            were merged into one table"""
+        index = OrderedDict((k, []) for k in ['source', 'phase', 'start', 'stop'])
+        lengths = np.diff(offsets) if offsets is not None else \
+            [len(next(iter(t.values()))) if t else 0 for t in tables]
+        for r, (events, n) in enumerate(zip(self.events, lengths)):
+            shift = offsets[r] if offsets is not None else 0
+            for phase, (start, stop) in phase_rows(events, int(n)).items():
+                index['source'].append(0 if offsets is not None else r)
+                index['phase'].append(phase)
+                index['start'].append(int(start + shift))
+                index['stop'].append(int(stop + shift))
+        if not index['source']:
+            return None
+        return index
+
     def make_plot(self, plot_width=800,plot_height=600,line_cols=['black','red','blue','green','orange'], 
-                  qual_list=None, x_qual=None, y_qual=None, verbose=False):
+                  qual_list=None, x_qual=None, y_qual=None, verbose=False, workers=None,
+                  lazy_columns=None, sidecar_dir='columns', downsample=None, downsample_method='lttb', lod=True,
+                  backend='canvas', webgl_threshold=200000, merge_tracks=False, dedupe=True, rows=None,
+                  derived=None, phases=True):
+        """builds the interactive plot.
+            lazy_columns: None to put every column in the page, 'embed' to embed all but the default
+                          x/y columns as gzipped chunks that are only decoded when selected, or
+                          'sidecar' to write them to files in sidecar_dir (relative to the saved page),
+                          named by the hash of their content, that are fetched when selected. sidecar
+                          files need the page to be served over http; browsers block fetch() from
+                          file:// pages
+            downsample: if set, the number of points drawn per track. the rows are picked with
+                        downsample_method ('lttb' or 'minmax') for the selected x/y pair, in numpy for
+                        the initial axes and in the page after an axis change. only the picked points
+                        are in the sources when the page loads: every full column is loaded lazily,
+                        embedded unless lazy_columns is 'sidecar'.
+            lod: with downsample, re-pick the drawn points from the rows in view when zooming in
+            backend: 'canvas', 'webgl', or 'auto' to use webgl when the tracks hold more than
+                     webgl_threshold points in total
+            merge_tracks: draw all tracks from one concatenated source (a run_id column tells them apart)
+                          with a single multi_line and a single scatter glyph, so axis switches touch
+                          one buffer however many runs there are. not for binary mode or downsample
+            dedupe: store columns that repeat across runs once in the page (see dedupe_columns)
+            rows: optional history_reader.RowFilter selecting the rows that are loaded, e.g.
+                  RowFilter({'star_age': (1e6, None)}, every=5). applied while the files are parsed
+            derived: optional mapping of name -> expression over the history columns, e.g.
+                     {'L_over_M': '10**log_L / star_mass'} (see expressions.py). evaluated once per file
+                     in numpy when the files are loaded and offered in the x/y selects like logged columns
+            phases: add a select that zooms to an evolutionary phase (main sequence, core He burning,
+                    Roche lobe overflow, ... see phases.py) of all tracks that reach it. not in follow mode"""
             
         if verbose:
             print('Loading history files: %s'%(self.history_files))
-            
-        loaded_history_files= self.load_history_files(qual_list=qual_list,x_qual=x_qual, y_qual=y_qual)
-        
-        source_list= loaded_history_files[0]
-        
-        qual_list = loaded_history_files[1]
-        x_qual = loaded_history_files[2]
-        y_qual= loaded_history_files[3]
-       
+
+        self.stats = PlotStats()
+        t0 = time.perf_counter()
+        # kept for rebind
+        self._data_options = dict(qual_list=qual_list, x_qual=x_qual, y_qual=y_qual, workers=workers,
+                                  lazy_columns=lazy_columns, sidecar_dir=sidecar_dir, downsample=downsample,
+                                  downsample_method=downsample_method, backend=backend,
+                                  webgl_threshold=webgl_threshold, merge_tracks=merge_tracks, dedupe=dedupe,
+                                  rows=rows, derived=derived, phases=phases, line_cols=line_cols)
+        self._layout_options = dict(plot_width=plot_width, plot_height=plot_height, line_cols=line_cols, lod=lod)
+        page = self.page_data(**self._data_options)
+        if verbose:
+            print('Rendering with %s'%page['backend'])
+        self.build_layout(page, **self._layout_options)
+        self.text = self.page_text()
+        self._finish_stats(t0)
+
+    def page_data(self, qual_list=None, x_qual=None, y_qual=None, workers=None, lazy_columns=None,
+                  sidecar_dir='columns', downsample=None, downsample_method='lttb', backend='canvas',
+                  webgl_threshold=200000, merge_tracks=False, dedupe=True, rows=None, derived=None, phases=True,
+                  line_cols=['black','red','blue','green','orange']):
+        """loads the history files and prepares everything that goes into the page as plain columns,
+            without building any Bokeh models (see make_plot for the options). returns a dict of
+            tables: per drawn source, an OrderedDict of column -> array
+            views: with downsample, the x_data/y_data tables that are drawn, otherwise None
+            multi, offsets: with merge_tracks, the multi_line table and the row offsets of the runs
+            shared, lazy, phases: the tables of the dedupe, lazy column and phase indexes, or None
+            qual_list, x_qual, y_qual, x_field, y_field, lod_n, backend: the rest of the plot set up
+            structure: what the Bokeh models built from the tables depend on, see rebind"""
+        with self.stats.timer('parse'):
+            tables, qual_list, x_qual, y_qual = self.read_history_files(qual_list=qual_list,x_qual=x_qual,
+                                                                        y_qual=y_qual, workers=workers, rows=rows,
+                                                                        derived=derived, events=phases)
+
+        if self.followers is not None and (merge_tracks or downsample is not None or lazy_columns is not None):
+            raise ValueError('follow mode cannot be used with merge_tracks, downsample or lazy_columns')
+        if merge_tracks:
+            if self.mode == 'binary' or downsample is not None:
+                raise ValueError('merge_tracks cannot be used in binary mode or with downsample')
+            tables, multi, offsets = self.merge_sources(tables, qual_list, x_qual, y_qual, line_cols)
+        else:
+            multi, offsets = None, None
+        # the event rows would go stale as rows are streamed in follow mode
+        phase_index = self.phase_index(tables, offsets) if phases and self.followers is None else None
+
+        if dedupe and self.followers is None:
+            shared = self.dedupe_columns(tables, keep=(x_qual, y_qual, 'run_id'))
+        else:
+            shared = None
+
+        # the tables that are drawn. with downsampling, small views of the full tables
+        if downsample is not None:
+            pick = {'lttb': lttb, 'minmax': minmax}[downsample_method]
+            views = []
+            for t in tables:
+                x = np.asarray(t[x_qual])
+                y = np.asarray(t[y_qual])
+                idx = pick(x, y, downsample)
+                views.append(OrderedDict([('x_data', x[idx]), ('y_data', y[idx])]))
+            lod_n = downsample
+        else:
+            views = None
+            lod_n = 0
+        # the views are what a downsampled page draws when it loads, so the full columns, x/y among
+        # them, are only decoded when an axis change or zooming in needs them
+        if downsample is not None:
+            lazy = self.split_lazy_columns(tables, (), lazy_columns or 'embed', sidecar_dir)
+        else:
+            lazy = self.split_lazy_columns(tables, (x_qual, y_qual, 'run_id'), lazy_columns, sidecar_dir)
+        # the downsampled views hold the drawn points in x_data/y_data, the other glyphs draw the
+        # selected columns by name and have their fields switched on axis changes
+        x_field, y_field = ('x_data', 'y_data') if downsample is not None else (x_qual, y_qual)
+
+        if backend == 'auto':
+            n_points = sum(len(t[x_field]) for t in (views if views is not None else tables))
+            backend = 'webgl' if n_points > webgl_threshold else 'canvas'
+
+        structure = (self.mode, len(tables), views is not None, offsets is not None and len(offsets),
+                     shared is not None, lazy is not None, phase_index is not None, backend)
+        tables = [self.embed(t) for t in tables]
+        views = [self.embed(v) for v in views] if views is not None else None
+        multi = self.embed(multi)
+        return dict(tables=tables, views=views, multi=multi, offsets=offsets, shared=shared, lazy=lazy,
+                    phases=phase_index, qual_list=qual_list, x_qual=x_qual, y_qual=y_qual, x_field=x_field,
+                    y_field=y_field, lod_n=lod_n, backend=backend, structure=structure)
+
+    def build_layout(self, page, plot_width=800, plot_height=600, line_cols=['black','red','blue','green','orange'],
+                     lod=True):
+        """builds the Bokeh figure, widgets and callbacks of the plot from the tables returned by page_data"""
+        from bokeh.layouts import column, row
+        from bokeh.models import CustomJS, CheckboxButtonGroup, RadioGroup, Select, Button, LinearAxis, \
+            LinearColorMapper, CustomJSTransform, ColumnDataSource
+        from bokeh.plotting import figure
+        from bokeh.core.property.validation import validate
+
+        qual_list, x_qual, y_qual = page['qual_list'], page['x_qual'], page['y_qual']
+        x_field, y_field, lod_n, backend = page['x_field'], page['y_field'], page['lod_n'], page['backend']
+        offsets = page['offsets']
+        # the tables are built by page_data, so Bokeh's property validation of every column is skipped
+        with validate(False):
+            source_list = [ColumnDataSource(t) for t in page['tables']]
+            view_list = [ColumnDataSource(v) for v in page['views']] if page['views'] is not None else source_list
+            multi_source = ColumnDataSource(page['multi']) if page['multi'] is not None else None
+            shared, lazy, phase_source = [ColumnDataSource(page[k], name=name) if page[k] is not None else None
+                                          for k, name in (('shared', 'shared_columns'), ('lazy', 'lazy_columns'),
+                                                          ('phases', 'phase_index'))]
+        self._serialized = None
+
         TOOLTIPS = [("(x,y)", "($x, $y)")]
         fig = figure(  plot_width=plot_width, plot_height=plot_height, 
-                      x_axis_label=x_qual, y_axis_label=y_qual, tooltips=TOOLTIPS, name='plot')
+                      x_axis_label=x_qual, y_axis_label=y_qual, tooltips=TOOLTIPS, name='plot',
+                      output_backend=backend)
         # format the plot a bit
         fig.xgrid.visible = False
         fig.ygrid.visible = False
@@ -180,141 +860,93 @@ class iMESAplotter:
             fig.x_range.flipped = True
         
         
+        #the callbacks of the axis and scale widgets all go through one shared javascript module
+        js_module = CustomJS(code=_JS_MODULE, name='imp_module')
+
         lines=[]
         markers=[]
         col_cycle = cycle(line_cols)
+
+        if multi_source is not None:
+            n_runs = len(offsets) - 1
+            # one palette entry per run, so that run_id maps exactly to the colour of its line
+            mapper = LinearColorMapper(palette=[next(col_cycle) for i in range(n_runs)], low=-0.5, high=n_runs-0.5)
+            legend = dict(legend_field='label') if n_runs <= 30 else {}
+            # the lines are cut from the concatenated columns in the page (see split_runs)
+            split = _JS_IMPORT + 'return IMP.split_runs(xs, store, name, scale, offsets);'
+            multi_transforms = [CustomJSTransform(args=dict(module=js_module, store=source_list[0], offsets=offsets,
+                                                            name=q, scale=0), v_func=split)
+                                for q in (x_qual, y_qual)]
+            lines.append(fig.multi_line(dict(field='run', transform=multi_transforms[0]),
+                                        dict(field='run', transform=multi_transforms[1]), source=multi_source,
+                                        line_width=2., line_color='color', **legend))
+            markers.append(fig.scatter(x=x_qual, y=y_qual, source=source_list[0], marker="x", size=12, visible=False,
+                                       line_color={'field': 'run_id', 'transform': mapper}))
+            view_list = []
+        else:
+            multi_transforms = None
         
-        for s,i in zip(source_list, range(1, len(source_list)+1)):
+        for s,i in zip(view_list, range(1, len(view_list)+1)):
             col=next(col_cycle)
             if self.mode=='single':
-                lines.append(fig.line('x_data','y_data', source=s, line_width=2.,
+                lines.append(fig.line(x_field, y_field, source=s, line_width=2.,
                                        line_color=col ))
             else:
-                lines.append(fig.line('x_data','y_data', source=s, line_width=2.,
+                lines.append(fig.line(x_field, y_field, source=s, line_width=2.,
                                        line_color=col,legend_label='star%s'%i ))
-            markers.append(fig.scatter(x="x_data", y="y_data",source=s, line_color= col, marker="x", size=12,visible=False))
+            markers.append(fig.scatter(x=x_field, y=y_field,source=s, line_color= col, marker="x", size=12,visible=False))
+        if multi_source is not None:
+            renderers = markers
+        elif lod_n == 0:
+            renderers = lines + markers
+        else:
+            renderers = []
         
         #set up selectors for x and y quantities 
         select_x_value = Select(title="x-quantity", value=x_qual, options=qual_list, width=120, name='x_data_selector')
         select_y_value = Select(title="y-quantity", value=y_qual, options=qual_list, width=120, name='y_data_selector')
         x_scale_radiogroup = RadioGroup(labels=['x-scale linear','x-scale abs(log)', 'x-scale 10^'], active=0, name='x_scale_setter')
         y_scale_radiogroup = RadioGroup(labels=['y-scale linear','y-scale abs(log)', 'y-scale 10^'], active=0, name='y_scale_setter')
+        if phase_source is not None:
+            phase_names = list(OrderedDict.fromkeys(phase_source.data['phase']))
+            phase_select = Select(title="phase", value='all', options=['all'] + phase_names, width=120,
+                                  name='phase_selector')
+        else:
+            phase_select = None
         
+        # the abs(log) and 10^ scales, applied to the glyph fields
+        transforms = [CustomJSTransform(args=dict(module=js_module), func=func,
+                                        v_func=_JS_IMPORT + 'return IMP.scale_array(xs, %s);'%scale)
+                      for scale, func in ((1, 'return Math.log10(Math.abs(x));'), (2, 'return 10**x;'))]
+        js_args = dict(module=js_module, source_list=source_list, view_list=view_list, lod_n=lod_n,
+                       multi=multi_source, multi_transforms=multi_transforms, offsets=offsets,
+                       renderers=renderers, transforms=transforms,
+                       lazy=lazy, shared=shared, plot=fig, x_select=select_x_value, y_select=select_y_value,
+                       x_scale=x_scale_radiogroup, y_scale=y_scale_radiogroup, axx=fig.xaxis, axy=fig.yaxis,
+                       phases=phase_source, phase_select=phase_select)
+        js_ctx = """
+        const a = {source_list: source_list, view_list: view_list, lod_n: lod_n, lazy: lazy, shared: shared,
+                   plot: plot, multi: multi, multi_transforms: multi_transforms, offsets: offsets,
+                   renderers: renderers, transforms: transforms,
+                   x_select: x_select, y_select: y_select, x_scale: x_scale, y_scale: y_scale, axx: axx, axy: axy,
+                   phases: phases, phase_select: phase_select};
+        """
+
         #scale switching buttons
-        x_scale_radiogroup.js_on_click(CustomJS(
-            args=dict( source_list=source_list, ax1=fig.xaxis,x_select = select_x_value),
-        code="""
-        const s = cb_obj.active;
-        var x_val=x_select.value;
-        var l;
-        if (s==1){
-        
-        ax1[1].axis_label = 'log('+x_val +')';
-        console.log('changing x data to log' + ax1[0].axis_label);
-        for (l of source_list){
-            const data = l.data;
-            const x_data = data['x_data'];
-            for (var i = 0; i < x_data.length; i++) {
-                x_data[i]= Math.log10(Math.abs(data[x_val][i]));}
-            l.change.emit();}
-        }          
-        if (s==0){
-        ax1[1].axis_label = x_val ;
-        console.log('changing x data to linear' + s);
-        for (l of source_list){
-            const data = l.data;
-            const x_data = data['x_data'];
-            for (var i = 0; i < x_data.length; i++) {
-                x_data[i]= data[x_val][i];}
-            l.change.emit();}
-        }
-        if (s==2){
-        ax1[1].axis_label = '10^'+x_val ;
-        console.log('changing x data to 10^' + s);
-        for (l of source_list){
-            const data = l.data;
-            const x_data = data['x_data'];
-            for (var i = 0; i < x_data.length; i++) {
-                x_data[i]= 10**(data[x_val][i]);}
-            l.change.emit();}
-        }
-        """))
-        y_scale_radiogroup.js_on_click(CustomJS(args=dict( source_list=source_list, ax1=fig.yaxis,y_select = select_y_value),
-        code="""
-        const s = cb_obj.active;
-        var y_val=y_select.value;
-        var l;
-        if (s==1){
-        
-        ax1[0].axis_label = 'log('+y_val +')';
-        console.log('changing y data to log' + ax1[0].axis_label);
-        for (l of source_list){
-            const data = l.data;
-            const y_data = data['y_data'];
-            for (var i = 0; i < y_data.length; i++) {
-                y_data[i]= Math.log10(Math.abs(data[y_val][i]));}
-            l.change.emit();}
-        }
-        if (s==0){
-        ax1[0].axis_label = y_val ;
-        console.log('changing y data to linear' + s);
-        for (l of source_list){
-            const data = l.data;
-            const y_data = data['y_data'];
-            for (var i = 0; i < y_data.length; i++) {
-                y_data[i]= data[y_val][i];}
-            l.change.emit();}
-        }
-        if (s==2){
-        ax1[0].axis_label = '10^'+y_val ;
-        console.log('changing y data to 10^' + s);
-        for (l of source_list){
-            const data = l.data;
-            const y_data = data['y_data'];
-            for (var i = 0; i < y_data.length; i++) {
-                y_data[i]= 10**(data[y_val][i]);}
-            l.change.emit();}
-        }
-        """))
-        
-        x_val_callback=CustomJS(args=dict(source_list=source_list, ax1=fig.xaxis, plot=fig, y_select=select_y_value,x_scale =x_scale_radiogroup ),
-        code="""
+        scale_callback = CustomJS(args=js_args, code=_JS_IMPORT + js_ctx + """
+        IMP.request_update(a, false);
+        """)
+        x_scale_radiogroup.js_on_click(scale_callback)
+        y_scale_radiogroup.js_on_click(scale_callback)
+
+        #selecting a new quantity resets the scale of that axis to linear
+        x_val_callback=CustomJS(args=js_args, code=_JS_IMPORT + js_ctx + """
         x_scale.active=0;
-        if (y_select.value == 'log_L' && cb_obj.value=='log_Teff'){
-            plot.x_range.flipped = true;
-        }else{
-            plot.x_range.flipped = false;}
-        var x_new = cb_obj.value;
-        console.log('ax1:' + ax1)
-        ax1[1].axis_label = x_new;
-        var l;
-        for (l of source_list){
-            const data = l.data;
-            const x_data = data['x_data'];
-            for (var i = 0; i < x_data.length; i++) {
-            x_data[i]=data[x_new][i];
-            }
-            l.change.emit();
-        }
+        IMP.request_update(a, true);
         """)
-        y_val_callback=CustomJS(args=dict(source_list=source_list, ax1=fig.yaxis, plot=fig, x_select = select_x_value, y_scale =y_scale_radiogroup ),
-        code="""
+        y_val_callback=CustomJS(args=js_args, code=_JS_IMPORT + js_ctx + """
         y_scale.active=0;
-        if (x_select.value == 'log_Teff' && cb_obj.value=='log_L'){
-            plot.x_range.flipped = true;
-        }else{
-            plot.x_range.flipped = false;}
-        var y_new = cb_obj.value;
-        console.log('ax1:' + ax1)
-        ax1[0].axis_label = y_new;
-        var l;
-        for (l of source_list){
-            const data = l.data;
-            const y_data = data['y_data'];
-            for (var i = 0; i < y_data.length; i++) {
-                y_data[i]=data[y_new][i];}
-            l.change.emit();
-        }
+        IMP.request_update(a, true);
         """)
         select_x_value.js_on_change('value', x_val_callback)
         select_y_value.js_on_change('value', y_val_callback)
@@ -322,31 +954,41 @@ class iMESAplotter:
         
         #set up reset button
         reset_button= Button(label='Reset', height=40, width=80, name='reset_button')
-        reset_call = CustomJS(args=dict(lines=lines, source_list=source_list,p=fig,x_select = select_x_value,                 y_select=select_y_value,x_qual=x_qual, 
-        y_qual=y_qual,x_scale =x_scale_radiogroup,y_scale =y_scale_radiogroup ,axy=fig.yaxis,axx=fig.xaxis ),
-           code="""
+        reset_call = CustomJS(args=dict(js_args, lines=lines, x_qual=x_qual, y_qual=y_qual),
+           code=_JS_IMPORT + js_ctx + """
         y_scale.active=0;
         x_scale.active=0;
-        axy[0].axis_label = y_qual ;
-        axx[1].axis_label = x_qual ;
-        var l;
-        for (l of source_list){
-            const data = l.data;
-            const x_data = data['x_data'];
-            for (var i = 0; i < x_data.length; i++) {
-                x_data[i]= data[x_qual][i];}
-            const y_data = data['y_data'];
-            for (var i = 0; i < y_data.length; i++) {
-                y_data[i]= data[y_qual][i];}
-            l.change.emit();}
         x_select.value = x_qual;
         y_select.value = y_qual;
+        IMP.request_update(a, true);
         
-        lines[0].visible=true;
-        lines[1].visible=true;
-        p.reset.emit();
+        for (const l of lines.slice(0, 2)) {
+            l.visible=true;}
+        if (phase_select != null) {
+            phase_select.value = 'all';}
+        plot.reset.emit();
         """)
         reset_button.js_on_click( reset_call)
+        js_callbacks = [scale_callback, x_val_callback, y_val_callback, reset_call]
+
+        #jump to an evolutionary phase
+        if phase_select is not None:
+            phase_call = CustomJS(args=js_args, code=_JS_IMPORT + js_ctx + """
+            IMP.load_selected(a).then(() => IMP.show_phase(a, cb_obj.value));
+            """)
+            phase_select.js_on_change('value', phase_call)
+            js_callbacks.append(phase_call)
+
+        #refine the downsampled tracks to the visible window after zooming/panning
+        if lod_n > 0 and lod:
+            lod_call = CustomJS(args=js_args, code=_JS_IMPORT + js_ctx + """
+            clearTimeout(plot._lod_timer);
+            plot._lod_timer = setTimeout(() => IMP.update_lod(a), 150);
+            """)
+            for r in (fig.x_range, fig.y_range):
+                r.js_on_change('start', lod_call)
+                r.js_on_change('end', lod_call)
+            js_callbacks.append(lod_call)
          #set up show/hide markers button 
         marker_button= CheckboxButtonGroup(labels=['Show markers'], active=[], height=40, width=80, name='show_marker_box')
         marker_call = CustomJS(args=dict(markers=markers,lines=lines,p=fig),
@@ -360,6 +1002,7 @@ class iMESAplotter:
             m.change.emit();}
         """)
         marker_button.js_on_click( marker_call)
+        phase_widgets = [phase_select] if phase_select is not None else []
         if self.mode=='binary':
             #buttons for hiding star 1 & 2 
             js_code="""
@@ -388,26 +1031,37 @@ class iMESAplotter:
             layout =  row(column(select_x_value,select_y_value,
                                  show_1_box, show_2_box,
                                  reset_button,marker_button,
-                                 x_scale_radiogroup, y_scale_radiogroup, name='widgets'),column(fig, name='plot'))
+                                 x_scale_radiogroup, y_scale_radiogroup, *phase_widgets, name='widgets'),
+                          column(fig, name='plot'))
 
         else:
             layout =  row(column( select_x_value,select_y_value, 
                                  reset_button,marker_button,
-                                 x_scale_radiogroup, y_scale_radiogroup, name='widgets'),column(fig, name='plot'))
+                                 x_scale_radiogroup, y_scale_radiogroup, *phase_widgets, name='widgets'),
+                          column(fig, name='plot'))
         self.figure=fig
+        self.sources = source_list
+        self.views = view_list
         self.layout=layout
         self.lines= lines
         self.markers=markers
         self.widgets = [select_x_value,select_y_value, 
                                  reset_button,marker_button,
-                                 x_scale_radiogroup, y_scale_radiogroup]
-        script, div = components(self.layout)
-        
+                                 x_scale_radiogroup, y_scale_radiogroup] + phase_widgets
+        self.phase_source = phase_source
+        # the models rebind refills with the data of other runs
+        self._skeleton = dict(structure=page['structure'], sources=source_list, views=view_list,
+                              multi=multi_source, multi_transforms=multi_transforms, shared=shared, lazy=lazy,
+                              phases=phase_source,
+                              glyphs=renderers, callbacks=js_callbacks, reset=reset_call)
+
+    def page_text(self):
+        """the html put below the plot: the initial binary parameters and the directories of the runs"""
         txt=''
         if self.mode=='binary':
             #check for binary_history.data file, if exsists get initial binary params
             if os.path.isfile(os.path.join(self.dir, 'binary_history.data')):
-                header_data= self.load_data(os.path.join(self.dir, 'binary_history.data'))[4]
+                header_data= read_header(os.path.join(self.dir, 'binary_history.data'))[0]
                 M1i = round(header_data['initial_don_mass'],2)
                 M2i=round(header_data['initial_acc_mass'],2)
                 if M1i==0:
@@ -424,17 +1078,285 @@ class iMESAplotter:
             txt+= """<p>Plot generated from directory %s</p>"""%(self.dir)
             
             
-        self.text = txt
-        
-            
+        return txt
+
+    def rebind(self, directory):
+        """points the plotter at other runs of the same mode and refills the plot built by make_plot
+            with their data, using the same options. the figure, widgets and callbacks are kept and only
+            the data and the run dependent settings (selects, glyph fields, axis labels) change, so
+            building many pages (e.g. all runs of a grid) costs little more than loading and serializing
+            their data. if the new runs need a different set of models (a different number of tracks,
+            an index source only one of them has, another backend), the plot is built again.
+            returns True if the plot was refilled, False if it was rebuilt"""
+        if self.followers is not None:
+            raise ValueError('rebind cannot be used in follow mode')
+        self._set_history_files(directory)
+        self.stats = PlotStats()
+        t0 = time.perf_counter()
+        page = self.page_data(**self._data_options)
+        skeleton = self._skeleton
+        refill = page['structure'] == skeleton['structure']
+        if refill:
+            # components() leaves the layout in a document, which would recollect its models on every change
+            if self.layout.document is not None:
+                self.layout.document.remove_root(self.layout)
+            from bokeh.core.property.validation import validate
+            with validate(False):
+                for models, tables in ((skeleton['sources'], page['tables']), (skeleton['views'], page['views'])):
+                    for m, t in zip(models, tables or []):
+                        m.data = t
+                for k in ('multi', 'shared', 'lazy', 'phases'):
+                    if skeleton[k] is not None:
+                        skeleton[k].data = page[k]
+            self._set_axes(page)
+            self._serialized = None
+        else:
+            self.build_layout(page, **self._layout_options)
+        self.text = self.page_text()
+        self._finish_stats(t0)
+        return refill
+
+    def _set_axes(self, page):
+        """sets the run dependent state of the widgets and glyphs of a refilled plot"""
+        x_qual, y_qual, qual_list = page['x_qual'], page['y_qual'], page['qual_list']
+        select_x, select_y, reset, markers, x_scale, y_scale = self.widgets[:6]
+        select_x.update(options=qual_list, value=x_qual)
+        select_y.update(options=qual_list, value=y_qual)
+        x_scale.active = y_scale.active = 0
+        if self.phase_source is not None:
+            self.widgets[6].update(options=['all'] + list(OrderedDict.fromkeys(page['phases']['phase'])),
+                                   value='all')
+        for r in self._skeleton['glyphs']:
+            r.glyph.update(x=x_qual, y=y_qual)
+        self._skeleton['reset'].args.update(x_qual=x_qual, y_qual=y_qual)
+        if page['offsets'] is not None:
+            for cb in self._skeleton['callbacks']:
+                cb.args.update(offsets=page['offsets'])
+            for t, q in zip(self._skeleton['multi_transforms'], (x_qual, y_qual)):
+                t.args.update(offsets=page['offsets'], name=q, scale=0)
+        self.figure.below[0].axis_label = x_qual
+        self.figure.left[0].axis_label = y_qual
+        self.figure.x_range.flipped = (x_qual=='log_Teff' and y_qual=='log_L')
+
+    def _finish_stats(self, t0):
+        skeleton = self._skeleton
+        # the sources are known, searching the layout for them would take longer than building it
+        sources = list(skeleton['sources'])
+        if skeleton['views'] is not skeleton['sources']:
+            sources += skeleton['views']
+        sources += [skeleton[k] for k in ('multi', 'shared', 'lazy', 'phases') if skeleton[k] is not None]
+        self.stats.measure_sources(sources)
+        self.stats.timers['build'] = time.perf_counter() - t0 - self.stats.timers['parse']
+
+    def merge_sources(self, tables, qual_list, x_qual, y_qual, line_cols):
+        """concatenates the tables of all runs into one table with a run_id column.
+            returns ([merged table], multi_line table with one row per run, row offsets of the runs).
+            the multi_line table holds the run index, colour and label of each line, its x/y are cut
+            from the merged columns in the page"""
+        lengths = [len(t[x_qual]) for t in tables]
+        offsets = [0] + np.cumsum(lengths).tolist()
+        merged = OrderedDict()
+        for q in qual_list:
+            merged[q] = np.concatenate([np.asarray(t[q]) for t in tables])
+        merged['run_id'] = np.repeat(np.arange(len(tables), dtype=np.int32), lengths)
+
+        col_cycle = cycle(line_cols)
+        n_runs = len(tables)
+        multi = OrderedDict([
+            ('run', np.arange(n_runs, dtype=np.int32)),
+            ('color', [next(col_cycle) for r in range(n_runs)]),
+            ('label', ['star%s'%(r+1) for r in range(n_runs)])])
+        return [merged], multi, offsets
+
+    def dedupe_columns(self, tables, keep=()):
+        """moves columns that repeat across runs out of the tables: a constant column is stored as
+            its value, and a column whose first rows (at least half of them) are the same as those of
+            the column of that name in another table (e.g. model_number) as a reference to that
+            column plus its remaining rows. the page rebuilds them when they are selected.
+            keep: columns that stay in the tables, because they are drawn when the page loads
+            returns a table indexing the moved columns, or None if none were moved"""
+        index = OrderedDict((k, []) for k in ['source', 'column', 'owner', 'prefix', 'length', 'tail'])
+        # columns left in the tables, by name and first rows, as candidates to share rows with
+        owners = {}
+        # longest runs first, so that shorter runs reference them
+        lengths = [len(next(iter(t.values()))) if t else 0 for t in tables]
+        for i in sorted(range(len(tables)), key=lambda i: -lengths[i]):
+            t, n = tables[i], lengths[i]
+            for q in list(t):
+                if q in keep:
+                    continue
+                values = np.asarray(t[q])
+                owner, prefix = -1, 0
+                if n > 1 and (values == values[0]).all():
+                    tail = values[:1]
+                elif n >= MIN_SHARED_ROWS:
+                    key = (q, values.dtype.str, values[:MIN_SHARED_ROWS].tobytes())
+                    for j, other in owners.get(key, []):
+                        m = min(len(other), n)
+                        differ = np.flatnonzero(other[:m] != values[:m])
+                        common = differ[0] if len(differ) else m
+                        if common > prefix:
+                            owner, prefix = j, common
+                    if 2*prefix < n:
+                        owners.setdefault(key, []).append((i, values))
+                        continue
+                    tail = values[prefix:]
+                else:
+                    continue
+                del t[q]
+                index['source'].append(i)
+                index['column'].append(q)
+                index['owner'].append(owner)
+                index['prefix'].append(int(prefix))
+                index['length'].append(n)
+                index['tail'].append(tail)
+        if not index['source']:
+            return None
+        return index
+
+    def split_lazy_columns(self, tables, keep, lazy_columns, sidecar_dir):
+        """moves all but the columns in keep out of the tables for lazy loading.
+            returns a table indexing the moved columns, or None"""
+        self.lazy_files = {}
+        if lazy_columns is None:
+            return None
+        if lazy_columns not in ('embed', 'sidecar'):
+            raise ValueError("lazy_columns must be None, 'embed' or 'sidecar'")
+        index = OrderedDict((k, []) for k in ['source', 'column', 'url', 'dtype'])
+        for i, t in enumerate(tables):
+            for q in list(t):
+                if q in keep:
+                    continue
+                values = np.asarray(t.pop(q))
+                dtype = 'float32' if values.dtype == np.float32 else 'float64'
+                # mtime 0: the same column always gives the same bytes
+                chunk = gzip.compress(values.astype(np.dtype(dtype).newbyteorder('<')).tobytes(), mtime=0)
+                if lazy_columns == 'embed':
+                    url = 'data:application/gzip;base64,' + base64.b64encode(chunk).decode()
+                else:
+                    # named by their content, so pages saved to the same directory can share the
+                    # files of equal columns but never overwrite each other's
+                    url = '%s/%s.gz' % (sidecar_dir, hashlib.sha1(chunk).hexdigest())
+                    self.lazy_files[url] = chunk
+                index['source'].append(i)
+                index['column'].append(q)
+                index['url'].append(url)
+                index['dtype'].append(dtype)
+        return index
+
+    def stream_new_rows(self, rollover=None):
+        """with follow=True, parses the rows appended to each history file since the last call and
+            streams them into the plot (keeping at most rollover rows per track). if MESA restarted
+            from an earlier model, the rows it is redoing are replaced. meant to be called
+            periodically from a Bokeh server app, see follow_app.py"""
+        for h, s in zip(self.history_files, self.sources):
+            new, restarted = self.followers[h].read()
+            if new:
+                new.update(evaluate_expressions(self.expressions, new))
+            new = OrderedDict((c, self.compact(new[c])) for c in s.data if c in new)
+            if not new or (len(next(iter(new.values()))) == 0 and not restarted):
+                continue
+            if 'model_number' in new:
+                old_mn = np.asarray(s.data['model_number'])
+                if not restarted and len(old_mn) and new['model_number'].min() <= old_mn[-1]:
+                    # restart from an earlier model: rebuild the track, dropping the redone rows
+                    new = OrderedDict((c, np.concatenate([np.asarray(s.data[c]), v])) for c, v in new.items())
+                    restarted = True
+                keep = drop_overwritten(new['model_number'])
+                new = OrderedDict((c, v[keep]) for c, v in new.items())
+            if restarted:
+                s.data = dict(new)
+            else:
+                s.stream(dict(new), rollover=rollover)
+
     def show_plot(self):
+        from bokeh.plotting import show
         show(self.layout)
 
-    def save_plot(self, page_name='Plot.html', page_title='MESA Model'):
-        script, div = components(self.layout)
+    def render_page(self, script, div, page_title='MESA Model', resources_url=None):
+        """fills the html template with the script and div returned by components(self.layout)"""
+        import bokeh
+        if self.template is None:
+            from jinja2 import Environment, BaseLoader
+            self.template= Environment(loader=BaseLoader()).from_string(self.html_template)
+        bundles = bokeh_js_bundles(webgl=self.figure.output_backend == 'webgl')
+        if resources_url is None:
+            js_files = ['https://cdn.bokeh.org/bokeh/release/%s-%s.min.js'%(b, bokeh.__version__) for b in bundles]
+        else:
+            js_files = ['%s/%s-%s.min.js'%(resources_url.rstrip('/'), b, bokeh.__version__) for b in bundles]
+
+        return self.template.render(page_title=page_title,script=script, divs=div, bokeh_version=bokeh.__version__, 
+                     text=self.text, js_files=js_files)
+
+    @contextmanager
+    def profile(self, output=None, profiler='cprofile'):
+        """profiles the code run inside the with block, e.g.
+                with mp.profile('plot.prof'):
+                    mp.make_plot()
+                    mp.save_plot()
+            profiler: 'cprofile', or 'pyinstrument' if it is installed
+            output: file to write the profile to (cProfile stats, or pyinstrument html/text by extension).
+                    if None, a summary is printed"""
+        if profiler == 'cprofile':
+            import cProfile, pstats
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                yield prof
+            finally:
+                prof.disable()
+                if output is None:
+                    pstats.Stats(prof).sort_stats('cumulative').print_stats(30)
+                else:
+                    prof.dump_stats(output)
+        elif profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            prof = Profiler()
+            prof.start()
+            try:
+                yield prof
+            finally:
+                prof.stop()
+                if output is None:
+                    print(prof.output_text())
+                else:
+                    with open(output, 'w') as f:
+                        f.write(prof.output_html() if output.endswith('.html') else prof.output_text())
+        else:
+            raise ValueError("profiler must be 'cprofile' or 'pyinstrument'")
+
+    def serialize(self, refresh=False):
+        """returns (script, div) of the layout, as bokeh.embed.components. the result is kept and reused
+            by later calls (e.g. saving the page with CDN and with local resources) until make_plot or
+            rebind build new data; pass refresh=True after changing the layout in between"""
+        if self._serialized is None or refresh:
+            from bokeh.embed import components
+            self._serialized = components(self.layout)
+        return self._serialized
 
-        page=self.template.render(page_title=page_title,script=script, divs=div, bokeh_version=bokeh.__version__, 
-                     text=self.text)
+    def save_plot(self, page_name='Plot.html', page_title='MESA Model', resources_url=None):
+        """writes the plot to an html page.
+            resources_url: url (e.g. relative to the page) of a directory filled by write_bokeh_resources.
+                           if None, BokehJS is loaded from the Bokeh CDN
+            fills in the serialize/render/write timers and page_bytes of self.stats, then calls
+            stats_callback with it. the layout is serialized once (see serialize)"""
+        with self.stats.timer('serialize'):
+            script, div = self.serialize()
+        with self.stats.timer('render'):
+            page = self.render_page(script, div, page_title=page_title, resources_url=resources_url)
         
-        with open( page_name, 'w') as f:
-                f.write(page)
+        with self.stats.timer('write'):
+            with open( page_name, 'w') as f:
+                    f.write(page)
+            # lazily loaded columns written next to the page (lazy_columns='sidecar')
+            # (the files are named by their content: one already there holds the same bytes)
+            for url, chunk in self.lazy_files.items():
+                path = os.path.join(os.path.dirname(page_name), url)
+                if os.path.isfile(path):
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(chunk)
+        self.stats.page_bytes = os.path.getsize(page_name)
+        if self.stats_callback is not None:
+            self.stats_callback(self.stats)
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# compares the size of saved pages, the time to build and save them, and the time a browser
+# spends reading their data for the list embedding of rounded columns (encoding='list', the
+# default with round_num) and the typed-array embedding with float64, float32 and rounding
+#   usage: python3 benchmarks/bench_embed.py [repeat]
+# load is the time node takes to JSON.parse the page's document and decode its base64 arrays,
+# the way BokehJS does before it builds the models (best of repeat runs). drawing is not
+# measured, it does not depend on the embedding. needs node, load is n/a without it
+import os, sys, glob, gzip, json, time, shutil, tempfile, subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from IMP import iMESAplotter
+
+here = os.path.dirname(os.path.abspath(__file__))
+model_dirs = sorted(glob.glob(os.path.join(here, '..', 'models', 'single', '*')))
+
+# reads docs_json from the page given as argument, as BokehJS embed_items and Document.from_json do
+LOAD_JS = r"""
+const page = require('fs').readFileSync(process.argv[2], 'utf8');
+const literal = page.match(/const docs_json = ('(?:[^'\\]|\\.)*');/)[1];
+const text = eval(literal);
+function decode(v) {
+    if (Array.isArray(v)) {
+        v.forEach(decode);
+    } else if (v !== null && typeof v == 'object') {
+        if (typeof v.__ndarray__ == 'string') {
+            const s = atob(v.__ndarray__);
+            const bytes = new Uint8Array(s.length);
+            for (let i = 0; i < s.length; i++) {
+                bytes[i] = s.charCodeAt(i);}
+            v.array = (v.dtype == 'float32') ? new Float32Array(bytes.buffer) : bytes.buffer;
+        } else {
+            Object.values(v).forEach(decode);}
+    }
+}
+let best = Infinity;
+for (let r = 0; r < Number(process.argv[3]); r++) {
+    const t0 = process.hrtime.bigint();
+    decode(JSON.parse(text));
+    best = Math.min(best, Number(process.hrtime.bigint() - t0) / 1e6);
+}
+console.log(best);
+"""
+
+
+def load_ms(page_file, repeat):
+    node = shutil.which('node')
+    if node is None:
+        return None
+    with tempfile.NamedTemporaryFile('w', suffix='.js', delete=False) as f:
+        f.write(LOAD_JS)
+    try:
+        out = subprocess.run([node, f.name, page_file, str(repeat)], capture_output=True, text=True, check=True)
+    finally:
+        os.remove(f.name)
+    return float(out.stdout)
+
+
+def report(label, mp, t_build, repeat):
+    out = tempfile.NamedTemporaryFile(suffix='.html', delete=False).name
+    t0 = time.perf_counter()
+    mp.save_plot(page_name=out)
+    t = time.perf_counter() - t0 + t_build
+    with open(out, 'rb') as f:
+        page = f.read()
+    ms = load_ms(out, repeat)
+    os.remove(out)
+    print('%-28s %10.1f kB %10.1f kB gzip %8.3f s %10s' % (label, len(page) / 1e3, len(gzip.compress(page)) / 1e3, t,
+                                                          'n/a' if ms is None else '%.1f ms' % ms))
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('%-28s %13s %18s %10s %10s' % ('embedding', 'page', '', 'build+save', 'load'))
+    cases = [('lists, round_num=4', dict(round_num=4)),
+             ('float64, round_num=4', dict(round_num=4, encoding='binary')),
+             ('float64', dict()),
+             ('float32', dict(dtype='float32')),
+             ('float32, round_num=4', dict(round_num=4, dtype='float32'))]
+    for label, kwargs in cases:
+        mp = iMESAplotter(model_dirs, mode='multiple', **kwargs)
+        t0 = time.perf_counter()
+        mp.make_plot(x_qual='log_Teff', y_qual='log_L')
+        report(label, mp, time.perf_counter() - t0, repeat)
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# compares history_reader.read_history with the old np.genfromtxt + eval path
+# on a scaled-up copy of models/single/1/LOGS/history.data
+#   usage: python3 benchmarks/bench_reader.py [scale]
+import os, sys, time, tempfile
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from history_reader import read_history
+
+here = os.path.dirname(os.path.abspath(__file__))
+source_file = os.path.join(here, '..', 'models', 'single', '1', 'LOGS', 'history.data')
+
+
+def scaled_copy(file, scale):
+    """writes a copy of file with the bulk rows repeated scale times"""
+    with open(file) as f:
+        lines = f.readlines()
+    head, rows = lines[:6], lines[6:]
+    out = tempfile.NamedTemporaryFile('w', suffix='.data', delete=False)
+    out.writelines(head)
+    for i in range(scale):
+        out.writelines(rows)
+    out.close()
+    return out.name
+
+
+def read_genfromtxt(file):
+    """the loading path used by iMESAplotter.load_data before history_reader"""
+    bulk_data = np.genfromtxt(file, skip_header=5, names=True, dtype=None)
+    with open(file) as f:
+        for i, line in enumerate(f):
+            if i == 1:
+                header_names = line.split()
+            elif i == 2:
+                header_data = [eval(datum) for datum in line.split()]
+            elif i > 2:
+                break
+    return dict(zip(header_names, header_data)), bulk_data
+
+
+def best_of(func, repeat=3):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+if __name__ == '__main__':
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    file = scaled_copy(source_file, scale)
+    try:
+        header, data = read_history(file)
+        print('%s rows x %s columns (%.1f MB)' % (len(data['model_number']), len(data),
+                                                   os.path.getsize(file) / 1e6))
+        t_old = best_of(lambda: read_genfromtxt(file))
+        t_new = best_of(lambda: read_history(file))
+        t_sub = best_of(lambda: read_history(file, columns=['log_Teff', 'log_L']))
+        print('np.genfromtxt          : %8.3f s' % t_old)
+        print('read_history           : %8.3f s  (x%.1f)' % (t_new, t_old / t_new))
+        print('read_history, 2 columns: %8.3f s  (x%.1f)' % (t_sub, t_old / t_sub))
+    finally:
+        os.remove(file)
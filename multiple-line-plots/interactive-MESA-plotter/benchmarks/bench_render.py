@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# headless render time of the canvas and webgl backends on copies of the bundled
+# models/single/* runs. needs selenium with a chrome or firefox webdriver
+# (the same setup as bokeh.io.export_png); without them it says so and exits
+#   usage: python3 benchmarks/bench_render.py [copies] [repeat]
+#     copies: number of copies of each bundled run (default 30)
+#     repeat: timed exports per backend, the best is reported (default 3)
+# an export includes loading the page and taking the screenshot, the same for both backends
+import os, sys, time, shutil, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bench_workers import make_grid
+from IMP import iMESAplotter
+from bokeh.io import export_png
+
+
+def create_driver():
+    """a headless webdriver, or None after printing why there is none"""
+    try:
+        from bokeh.io.webdriver import webdriver_control
+    except RuntimeError as e:
+        # bokeh.io.webdriver raises RuntimeError when selenium is not installed
+        print('skipped: %s' % e)
+        return None
+    try:
+        return webdriver_control.create()
+    except Exception as e:
+        print('skipped: no chrome or firefox webdriver could be started (%s: %s)' % (type(e).__name__, e))
+        return None
+
+
+if __name__ == '__main__':
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    driver = create_driver()
+    if driver is None:
+        sys.exit(0)
+    from bokeh.io.webdriver import webdriver_control
+    root = tempfile.mkdtemp()
+    try:
+        run_dirs = make_grid(root, copies, 1)
+        print('%s tracks, best of %s exports' % (len(run_dirs), repeat))
+        for backend in ['canvas', 'webgl']:
+            mp = iMESAplotter(run_dirs, mode='multiple')
+            mp.make_plot(x_qual='log_Teff', y_qual='log_L', backend=backend)
+            # the first export also loads BokehJS into the driver
+            export_png(mp.figure, filename=os.path.join(root, 'warmup.png'), webdriver=driver)
+            times = []
+            for i in range(repeat):
+                t0 = time.perf_counter()
+                export_png(mp.figure, filename=os.path.join(root, '%s.png' % backend), webdriver=driver)
+                times.append(time.perf_counter() - t0)
+            print('%-7s %.3f s' % (backend, min(times)))
+    finally:
+        webdriver_control.terminate(driver)
+        shutil.rmtree(root)
@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+# times every stage of building a page on a synthetic grid (see synthetic.py):
+#   load_data           parsing one history file into a ColumnDataSource
+#   load_history_files  parsing all runs
+#   make_plot           building the Bokeh models, including its own read_history_files;
+#                       build is make_plot without that load
+#   components          serializing the layout to the page script
+#   render              filling the html template
+#   write               writing the page
+# each stage is the best of --repeat passes; the peak memory of each stage is
+# measured with tracemalloc in one more pass, so tracing does not slow the timed ones.
+# --json writes the results with the parameters and versions, and --compare prints the
+# ratio to an earlier results file, e.g. one written on another commit.
+# --profile runs one more pass under iMESAplotter.profile
+#   usage: python3 benchmarks/bench_stages.py --runs 20 --rows 5000 --json results.json
+import os, sys, json, time, shutil, argparse, platform, tempfile, subprocess, tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+import numpy as np
+import bokeh
+from bokeh.embed import components
+from IMP import iMESAplotter
+from synthetic import make_grid
+
+STAGES = ['load_data', 'load_history_files', 'make_plot', 'build', 'components', 'render', 'write']
+
+
+class Recorder:
+    """measures the stages run in its blocks, either the time or (with memory) the tracemalloc peak"""
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.values = OrderedDict()
+
+    @contextmanager
+    def __call__(self, stage):
+        if self.memory:
+            tracemalloc.reset_peak()
+            yield
+            self.values[stage] = tracemalloc.get_traced_memory()[1]
+        else:
+            t0 = time.perf_counter()
+            yield
+            self.values[stage] = time.perf_counter() - t0
+
+
+def one_pass(run_dirs, plot_options, workers, dtype, page_file, measure):
+    """runs every stage once. returns the size of the page in bytes"""
+    mp = iMESAplotter(run_dirs, mode='multiple', workers=workers, dtype=dtype)
+    with measure('load_data'):
+        mp.load_data(mp.history_files[0])
+    with measure('load_history_files'):
+        mp.load_history_files(x_qual=plot_options['x_qual'], y_qual=plot_options['y_qual'], workers=workers)
+
+    # make_plot loads the files again; that time is taken out for the build stage
+    inner = []
+    load = mp.read_history_files
+    def timed_load(*args, **kwargs):
+        t0 = time.perf_counter()
+        out = load(*args, **kwargs)
+        inner.append(time.perf_counter() - t0)
+        return out
+    mp.read_history_files = timed_load
+    with measure('make_plot'):
+        mp.make_plot(workers=workers, **plot_options)
+    if not measure.memory:
+        measure.values['build'] = measure.values['make_plot'] - sum(inner)
+
+    with measure('components'):
+        script, div = components(mp.layout)
+    with measure('render'):
+        page = mp.render_page(script, div)
+    with measure('write'):
+        with open(page_file, 'w') as f:
+            f.write(page)
+    return os.path.getsize(page_file)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return OrderedDict([('commit', commit), ('python', platform.python_version()), ('numpy', np.__version__),
+                        ('bokeh', bokeh.__version__), ('platform', platform.platform()),
+                        ('cpus', os.cpu_count())])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the stages of building an iMESAplotter page.')
+    parser.add_argument('--runs', type=int, default=10, help='number of synthetic runs')
+    parser.add_argument('--rows', type=int, default=2000, help='rows per run')
+    parser.add_argument('--columns', type=int, default=50, help='columns per run')
+    parser.add_argument('--repeat', type=int, default=3, help='timed passes, the best is reported')
+    parser.add_argument('--workers', type=int, default=1, help='processes parsing history files')
+    parser.add_argument('--downsample', type=int, default=None, help='make_plot downsample')
+    parser.add_argument('--merge-tracks', action='store_true', help='make_plot merge_tracks')
+    parser.add_argument('--dtype', default=None, help="dtype of the embedded columns, e.g. 'float32'")
+    parser.add_argument('--json', default=None, help='file to write the results to')
+    parser.add_argument('--compare', default=None, help='results file of an earlier run to compare with')
+    parser.add_argument('--profile', choices=['cprofile', 'pyinstrument'], default=None,
+                        help='profile one more pass of make_plot and save_plot')
+    parser.add_argument('--profile-out', default=None, help='file for the profile (default: print a summary)')
+    args = parser.parse_args(argv)
+
+    plot_options = dict(x_qual='log_Teff', y_qual='log_L', downsample=args.downsample,
+                        merge_tracks=args.merge_tracks)
+    root = tempfile.mkdtemp()
+    try:
+        run_dirs = make_grid(os.path.join(root, 'grid'), args.runs, args.rows, args.columns)
+        page_file = os.path.join(root, 'page.html')
+        times = OrderedDict((s, []) for s in STAGES)
+        for i in range(args.repeat):
+            measure = Recorder()
+            page_bytes = one_pass(run_dirs, plot_options, args.workers, args.dtype, page_file, measure)
+            for s, t in measure.values.items():
+                times[s].append(t)
+        memory = Recorder(memory=True)
+        tracemalloc.start()
+        try:
+            one_pass(run_dirs, plot_options, args.workers, args.dtype, page_file, memory)
+        finally:
+            tracemalloc.stop()
+
+        if args.profile is not None:
+            mp = iMESAplotter(run_dirs, mode='multiple', workers=args.workers, dtype=args.dtype)
+            with mp.profile(args.profile_out, profiler=args.profile):
+                mp.make_plot(workers=args.workers, **plot_options)
+                mp.save_plot(page_name=page_file)
+    finally:
+        shutil.rmtree(root)
+
+    params = OrderedDict((k, v) for k, v in vars(args).items()
+                         if k not in ('json', 'compare', 'profile', 'profile_out'))
+    results = OrderedDict([('params', params), ('environment', environment()), ('page_bytes', page_bytes),
+                           ('stages', OrderedDict())])
+    for s in STAGES:
+        results['stages'][s] = OrderedDict([('best_s', min(times[s])), ('times_s', times[s]),
+                                            ('peak_bytes', memory.values.get(s))])
+
+    old = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+    print('%s runs x %s rows x %s columns, page %.1f MB' % (args.runs, args.rows, args.columns, page_bytes / 1e6))
+    print('%-20s %10s %12s%s' % ('stage', 'best s', 'peak MB', '   vs %s' % old['environment']['commit'] if old else ''))
+    for s, r in results['stages'].items():
+        line = '%-20s %10.4f %12s' % (s, r['best_s'], '' if r['peak_bytes'] is None else '%.1f' % (r['peak_bytes'] / 1e6))
+        if old is not None and s in old['stages'] and old['stages'][s]['best_s'] > 0:
+            line += '   x%.2f' % (r['best_s'] / old['stages'][s]['best_s'])
+        print(line)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
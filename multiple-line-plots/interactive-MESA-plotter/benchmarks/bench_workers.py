@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+# times iMESAplotter.load_history_files with 1, 2, 4 and 8 worker processes
+# on copies of the bundled models/single/* runs
+#   usage: python3 benchmarks/bench_workers.py [copies] [scale] [repeat]
+#     copies: number of copies of each bundled run (default 20)
+#     scale: number of times the rows of each run are repeated (default 5)
+#     repeat: timed runs per worker count, the best is reported (default 3)
+# an untimed run first pays for the imports and reads the files into the page cache, so the
+# first worker count is not penalised. more workers than CPUs cannot be faster
+import os, sys, glob, time, shutil, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from IMP import iMESAplotter
+
+here = os.path.dirname(os.path.abspath(__file__))
+model_dirs = sorted(glob.glob(os.path.join(here, '..', 'models', 'single', '*')))
+
+
+def make_grid(root, copies, scale):
+    """copies every bundled run copies times, repeating its rows scale times"""
+    run_dirs = []
+    for m in model_dirs:
+        with open(os.path.join(m, 'LOGS', 'history.data')) as f:
+            lines = f.readlines()
+        text = ''.join(lines[:6] + lines[6:] * scale)
+        for i in range(copies):
+            d = os.path.join(root, '%s_%s' % (os.path.basename(m), i))
+            os.makedirs(os.path.join(d, 'LOGS'))
+            with open(os.path.join(d, 'LOGS', 'history.data'), 'w') as f:
+                f.write(text)
+            run_dirs.append(d)
+    return run_dirs
+
+
+def best_of(run_dirs, workers, repeat):
+    times = []
+    for i in range(repeat):
+        mp = iMESAplotter(run_dirs, mode='multiple')
+        t0 = time.perf_counter()
+        mp.load_history_files(workers=workers)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+if __name__ == '__main__':
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    scale = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    root = tempfile.mkdtemp()
+    try:
+        run_dirs = make_grid(root, copies, scale)
+        print('%s runs, %s CPUs, best of %s runs' % (len(run_dirs), os.cpu_count(), repeat))
+        # warm-up, not timed
+        iMESAplotter(run_dirs, mode='multiple').load_history_files()
+        t1 = None
+        for workers in [1, 2, 4, 8]:
+            t = best_of(run_dirs, workers, repeat)
+            if t1 is None:
+                t1 = t
+            print('workers=%s: %7.3f s  (speed-up x%.2f)' % (workers, t, t1 / t))
+    finally:
+        shutil.rmtree(root)
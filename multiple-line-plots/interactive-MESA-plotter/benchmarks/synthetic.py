@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# writes synthetic MESA history files in the format of the files under models/:
+# header section on lines 1-3, column numbers and names on lines 5-6, then one
+# right-aligned row per model. the usual columns (model_number, star_age,
+# log_Teff, log_L, center_h1, center_he4, ...) follow a smooth track through the
+# main sequence and core helium burning, so downsampling, dedupe and the phase
+# index see realistic data; the other columns are smooth random walks
+#   usage: python3 benchmarks/synthetic.py out_dir [runs] [rows] [columns]
+import os, sys
+import numpy as np
+
+WIDTH = 41
+HEADER = [('version_number', 12115), ('compiler', '"gfortran"'), ('build', '"9.2.0"'),
+          ('MESA_SDK_version', '"x86_64-linux-20190830"'), ('date', '"20211116"'),
+          ('burn_min1', 50.), ('burn_min2', 1000.)]
+TRACK_COLUMNS = ['model_number', 'star_age', 'star_mass', 'log_dt', 'log_Teff', 'log_L', 'log_R',
+                 'radius', 'center_h1', 'center_he4', 'log_center_T', 'log_center_Rho']
+
+
+def _cells(values):
+    return ''.join(str(v).rjust(WIDTH) for v in values) + ' \n'
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return str(value)
+    return '%.16E' % value
+
+
+def track(rows, columns, seed=0):
+    """returns a list of (name, values) of the columns of one synthetic track of rows models"""
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0., 1., rows)
+    mass = 1. + 9. * rng.random()
+    # main sequence until t=0.6, core helium burning from 0.7 to 0.95
+    h1 = 0.7 * np.clip((0.6 - t) / 0.55, 0., 1.) ** 0.8
+    he4 = np.where(t < 0.7, 0.98 - h1, 0.98 * np.clip((0.95 - t) / 0.25, 0., 1.))
+    log_Teff = 3.7 + 0.1 * np.log10(mass) - 0.3 * np.clip(t - 0.6, 0., None) + 0.01 * np.sin(20 * t)
+    log_L = 0.1 + 3.5 * np.log10(mass) + 0.5 * t + 0.02 * np.cos(15 * t)
+    log_R = 0.5 * log_L - 2. * (log_Teff - 3.76)
+    base = {'model_number': np.arange(1, rows + 1),
+            'star_age': 1e2 * np.exp(t * np.log(1e10 / mass ** 2.5 / 1e2)),
+            'star_mass': mass - 0.05 * t,
+            'log_dt': np.log10(np.gradient(1e2 * np.exp(t * 18.))),
+            'log_Teff': log_Teff, 'log_L': log_L, 'log_R': log_R, 'radius': 10 ** log_R,
+            'center_h1': h1, 'center_he4': he4,
+            'log_center_T': 7.1 + 0.5 * t, 'log_center_Rho': 1.5 + 2. * t}
+    out = []
+    for i in range(columns):
+        name = TRACK_COLUMNS[i] if i < len(TRACK_COLUMNS) else 'extra_%s' % (i - len(TRACK_COLUMNS) + 1)
+        values = base.get(name)
+        if values is None:
+            values = np.cumsum(rng.normal(size=rows)) * 10. ** rng.integers(-3, 4)
+        out.append((name, values))
+    return out
+
+
+def write_history(file, rows, columns, seed=0):
+    """writes a history file of rows models and columns columns"""
+    data = track(rows, columns, seed)
+    names = [n for n, v in data]
+    # model_number is an integer column, the others are written in fortran's E format
+    lines = np.full(rows, '', dtype='U1')
+    for name, values in data:
+        fmt = '%d' if name == 'model_number' else '%.16E'
+        lines = np.char.add(lines, np.char.rjust(np.char.mod(fmt, values), WIDTH))
+    os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+    with open(file, 'w') as f:
+        f.write(_cells(range(1, len(HEADER) + 1)))
+        f.write(_cells(n for n, v in HEADER))
+        f.write(_cells(_number(v) for n, v in HEADER))
+        f.write('\n')
+        f.write(_cells(range(1, len(names) + 1)))
+        f.write(_cells(names))
+        for line in lines:
+            f.write(line + ' \n')
+
+
+def make_grid(root, runs, rows, columns):
+    """writes runs single-star runs (root/<i>/LOGS/history.data) and returns their directories"""
+    run_dirs = []
+    for i in range(runs):
+        d = os.path.join(root, str(i))
+        write_history(os.path.join(d, 'LOGS', 'history.data'), rows, columns, seed=i)
+        run_dirs.append(d)
+    return run_dirs
+
+
+if __name__ == '__main__':
+    out = sys.argv[1]
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    rows = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    columns = int(sys.argv[4]) if len(sys.argv) > 4 else 50
+    make_grid(out, runs, rows, columns)
+    print('%s runs of %s rows x %s columns in %s' % (runs, rows, columns, out))
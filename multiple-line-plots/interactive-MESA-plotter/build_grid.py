@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+"""Builds interactive plots for a whole grid of MESA runs.
+
+Walks a grid directory, finds every run (a directory with binary_history.data
+is a binary run, otherwise a directory with */history.data is a single run)
+and writes one page per run plus, for every directory holding several single
+runs, a comparison page of all of them. Pages are rendered in a process pool.
+
+A manifest (manifest.json in the output directory) records the inputs of every
+page (path, mtime and size of its history files) and the plot options, so a
+rerun only rebuilds pages whose inputs changed. Pages load BokehJS from one
+shared copy in <output>/static instead of each fetching it from the CDN.
+Every worker builds the figure, widgets and callbacks once per mode and refills
+them with the data of its following runs (iMESAplotter.rebind).
+With --stats, the timings and sizes of every built page (see stats.py) are
+appended to a json lines file, one object per page, to spot oversized pages.
+
+    usage: python3 build_grid.py models/ -o pages --workers 8
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import bokeh
+
+from IMP import iMESAplotter, write_bokeh_resources
+from history_reader import RowFilter
+
+MANIFEST = 'manifest.json'
+
+# plotters built in this (worker) process, by mode and options, reused through iMESAplotter.rebind
+_plotters = {}
+
+
+def _bound(value):
+    """a --range bound: a number, or '-' for none"""
+    return None if value == '-' else float(value)
+
+
+def find_runs(root, history_file_name='history.data'):
+    """returns (single_runs, binary_runs), sorted lists of run directories under root"""
+    single, binary = set(), []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if 'binary_history.data' in filenames:
+            binary.append(dirpath)
+            # the history files of the two stars belong to the binary run
+            dirnames[:] = []
+        elif history_file_name in filenames:
+            # iMESAplotter looks for <run>/*/history.data
+            single.add(os.path.dirname(dirpath))
+    return sorted(single), binary
+
+
+def run_inputs(run_dir, mode, history_file_name='history.data'):
+    """the files a page of run_dir is built from"""
+    files = sorted(glob.glob(os.path.join(run_dir, '**/%s' % history_file_name)))
+    if mode == 'binary':
+        files.append(os.path.join(run_dir, 'binary_history.data'))
+    return files
+
+
+def stamp(files):
+    stamps = []
+    for f in files:
+        st = os.stat(f)
+        stamps.append([os.path.abspath(f), st.st_mtime_ns, st.st_size])
+    return stamps
+
+
+def plan_pages(root, out, compare=True):
+    """returns a list of page jobs: dict(page, mode, dirs, title, inputs)"""
+    single, binary = find_runs(root)
+    jobs = []
+    for mode, runs in (('single', single), ('binary', binary)):
+        for run_dir in runs:
+            rel = os.path.relpath(run_dir, root)
+            jobs.append(dict(page=os.path.join(out, rel + '.html'), mode=mode, dirs=run_dir,
+                             title=rel, inputs=run_inputs(run_dir, mode)))
+    if compare:
+        groups = {}
+        for run_dir in single:
+            groups.setdefault(os.path.dirname(run_dir), []).append(run_dir)
+        for parent, runs in sorted(groups.items()):
+            if len(runs) < 2:
+                continue
+            rel = os.path.relpath(parent, root)
+            inputs = sum((run_inputs(r, 'single') for r in runs), [])
+            jobs.append(dict(page=os.path.join(out, rel, 'compare.html'), mode='multiple', dirs=runs,
+                             title='%s (comparison)' % rel, inputs=inputs))
+    return jobs
+
+
+def build_page(job):
+    """renders one page. module level so it can run in a worker process.
+        returns (page, seconds, statistics of the page as a dict)"""
+    t0 = time.perf_counter()
+    key = json.dumps([job['mode'], job['cache_dir'], job['dtype'], job['rows'], job['plot_options']], sort_keys=True)
+    mp = _plotters.get(key)
+    if mp is None:
+        mp = iMESAplotter(job['dirs'], mode=job['mode'], cache_dir=job['cache_dir'], dtype=job['dtype'])
+        rows = RowFilter(**job['rows']) if job['rows'] is not None else None
+        mp.make_plot(rows=rows, **job['plot_options'])
+        _plotters[key] = mp
+    else:
+        mp.rebind(job['dirs'])
+    os.makedirs(os.path.dirname(job['page']), exist_ok=True)
+    mp.save_plot(page_name=job['page'], page_title=job['title'], resources_url=job['resources_url'])
+    return job['page'], time.perf_counter() - t0, mp.stats.as_dict()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build interactive MESA plots for a grid of runs.')
+    parser.add_argument('root', help='grid directory to search for runs')
+    parser.add_argument('-o', '--out', default='pages', help='output directory (default: pages)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of pages rendered in parallel')
+    parser.add_argument('--x-qual', default='log_Teff', help='initial x quantity')
+    parser.add_argument('--y-qual', default='log_L', help='initial y quantity')
+    parser.add_argument('--columns', default=None,
+                        help='comma separated columns to load (default: all columns the runs have in common)')
+    parser.add_argument('--range', nargs=3, action='append', default=[], metavar=('COLUMN', 'LOW', 'HIGH'),
+                        help="only load rows with LOW <= COLUMN <= HIGH ('-' for no bound), may be repeated")
+    parser.add_argument('--derived', action='append', default=[], metavar='NAME=EXPRESSION',
+                        help="derived quantity offered in the selects, e.g. 'L_over_M=10**log_L/star_mass', "
+                             "may be repeated")
+    parser.add_argument('--every', type=int, default=1, help='only load every n-th row (after --range)')
+    parser.add_argument('--downsample', type=int, default=None, help='points drawn per track')
+    parser.add_argument('--dtype', default=None, help="dtype of the embedded columns, e.g. 'float32'")
+    parser.add_argument('--cache-dir', default=None, help='directory of the parsed history file cache')
+    parser.add_argument('--no-compare', action='store_true', help='do not build comparison pages')
+    parser.add_argument('--cdn', action='store_true', help='load BokehJS from the CDN instead of <out>/static')
+    parser.add_argument('--force', action='store_true', help='rebuild all pages')
+    parser.add_argument('--stats', default=None, help='json lines file the statistics of every built page are appended to')
+    args = parser.parse_args(argv)
+
+    qual_list = args.columns.split(',') if args.columns else None
+    derived = OrderedDict(d.split('=', 1) for d in args.derived)
+    plot_options = dict(x_qual=args.x_qual, y_qual=args.y_qual, downsample=args.downsample, qual_list=qual_list,
+                        derived=derived)
+    rows = None
+    if args.range or args.every > 1:
+        rows = dict(ranges=OrderedDict((c, [_bound(lo), _bound(hi)]) for c, lo, hi in args.range), every=args.every)
+    options = dict(plot_options, rows=rows, dtype=args.dtype, cdn=args.cdn, bokeh_version=bokeh.__version__)
+
+    manifest_file = os.path.join(args.out, MANIFEST)
+    manifest = {'pages': {}}
+    if os.path.isfile(manifest_file) and not args.force:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    static_dir = os.path.join(args.out, 'static')
+    if not args.cdn:
+        write_bokeh_resources(static_dir)
+
+    jobs, todo = plan_pages(args.root, args.out, compare=not args.no_compare), []
+    entries = {}
+    for job in jobs:
+        key = os.path.relpath(job['page'], args.out)
+        entry = {'inputs': stamp(job['inputs']), 'options': options}
+        entries[key] = entry
+        if manifest['pages'].get(key) == entry and os.path.isfile(job['page']):
+            continue
+        job.update(plot_options=plot_options, rows=rows, cache_dir=args.cache_dir, dtype=args.dtype,
+                   resources_url=None if args.cdn else
+                   os.path.relpath(static_dir, os.path.dirname(job['page'])).replace(os.sep, '/'))
+        todo.append(job)
+    print('%s pages, %s to build' % (len(jobs), len(todo)))
+
+    failed = 0
+    stats_file = open(args.stats, 'a') if args.stats is not None else None
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [(job, pool.submit(build_page, job)) for job in todo]
+        for job, future in futures:
+            try:
+                page, t, stats = future.result()
+                print('%7.2f s  %s' % (t, page))
+                if stats_file is not None:
+                    stats_file.write(json.dumps(OrderedDict([('page', page), ('seconds', t)], **stats)) + '\n')
+            except Exception as e:
+                # left out of the manifest, so it is retried on the next run
+                print('FAILED  %s: %r' % (job['page'], e))
+                del entries[os.path.relpath(job['page'], args.out)]
+                failed += 1
+    if stats_file is not None:
+        stats_file.close()
+
+    # pages that are no longer in the grid are dropped from the manifest, not deleted
+    os.makedirs(args.out, exist_ok=True)
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump({'pages': entries}, f, indent=1)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
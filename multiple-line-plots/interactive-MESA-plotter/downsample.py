@@ -0,0 +1,54 @@
+"""Downsampling of long evolutionary tracks for display.
+
+Both functions return the indices of the rows to keep (always including the
+first and last row), so the same selection can be applied to any column.
+The selection depends on the (x, y) pair it was computed for.
+"""
+import numpy as np
+
+
+def lttb(x, y, n):
+    """largest-triangle-three-buckets: keeps n points that preserve the visual shape of the line x, y"""
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # the first and last points are kept, the others are split into n-2 buckets
+    edges = np.linspace(1, size - 1, n - 1).astype(np.intp)
+    counts = np.diff(edges)
+    # mean of every bucket, used as the third corner of the triangle for the bucket before it
+    x_mean = np.append(np.add.reduceat(x[:-1], edges[:-1]) / counts, x[-1])
+    y_mean = np.append(np.add.reduceat(y[:-1], edges[:-1]) / counts, y[-1])
+
+    idx = np.empty(n, dtype=np.intp)
+    idx[0] = 0
+    idx[-1] = size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - x_mean[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (y_mean[i + 1] - y[a]))
+        a = lo + np.argmax(np.nan_to_num(area, nan=-1.))
+        idx[i + 1] = a
+    return idx
+
+
+def minmax(x, y, n):
+    """keeps the points with the smallest and largest y in each of n//2 buckets along the track"""
+    size = len(x)
+    n_buckets = n // 2
+    if n >= size or n_buckets < 1:
+        return np.arange(size)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(0, size, n_buckets + 1).astype(np.intp)
+    # pad the buckets into a 2d array so that all of them are reduced in one call
+    width = np.diff(edges).max()
+    rows = edges[:-1, None] + np.arange(width)[None, :]
+    valid = rows < edges[1:, None]
+    rows = np.where(valid, rows, edges[:-1, None])
+    values = np.where(valid, y[rows], np.nan)
+    values = np.where(np.isnan(values), np.inf, values)
+    lo = rows[np.arange(n_buckets), np.argmin(values, axis=1)]
+    values = np.where(np.isinf(values), -np.inf, values)
+    hi = rows[np.arange(n_buckets), np.argmax(values, axis=1)]
+    return np.unique(np.concatenate([[0, size - 1], lo, hi]))
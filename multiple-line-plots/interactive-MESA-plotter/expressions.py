@@ -0,0 +1,124 @@
+"""Derived quantities: named arithmetic expressions over the columns of a MESA log file.
+
+An expression such as '10**log_L / star_mass' or 'log_R - 0.5*log_g' is parsed
+once with the ast module, checked against a small whitelist (numbers, column
+names, arithmetic and comparison operators and a few numpy functions, also
+written as np.log10 etc.) and compiled. It is then evaluated on whole columns
+at once, so a derived column costs one vectorized numpy pass per file.
+
+Only elementwise operations are allowed, so a derived column can be computed
+from any subset of rows (a RowFilter selection, or the rows streamed in
+follow mode) and gives the same values as computing it on the whole file and
+selecting the rows afterwards. Expressions may use derived quantities defined
+before them.
+"""
+import ast
+from collections import OrderedDict
+
+import numpy as np
+
+FUNCTIONS = {name: getattr(np, name) for name in [
+    'log10', 'log', 'log2', 'exp', 'sqrt', 'abs', 'sign', 'floor', 'ceil',
+    'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh', 'cosh', 'tanh',
+    'minimum', 'maximum', 'where', 'isfinite']}
+CONSTANTS = {'pi': np.pi}
+
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub,
+              ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+
+
+class Expression:
+    """a compiled derived quantity. names is the set of columns (or earlier derived
+        quantities) it uses"""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        try:
+            tree = ast.parse(text, mode='eval')
+        except SyntaxError as e:
+            raise ValueError('%s: cannot parse %r: %s' % (name, text, e.msg))
+        self.names = set()
+        self._check(tree.body)
+        self._code = compile(tree, '<%s>' % name, 'eval')
+
+    def _check(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            return
+        if isinstance(node, ast.Name):
+            if node.id not in FUNCTIONS and node.id not in CONSTANTS:
+                self.names.add(node.id)
+            return
+        if isinstance(node, ast.BinOp) and isinstance(node.op, _OPERATORS):
+            self._check(node.left)
+            self._check(node.right)
+            return
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, _OPERATORS):
+            self._check(node.operand)
+            return
+        if isinstance(node, ast.Compare) and all(isinstance(op, _OPERATORS) for op in node.ops):
+            for n in [node.left] + node.comparators:
+                self._check(n)
+            return
+        if isinstance(node, ast.Call) and not node.keywords and self._function(node.func) is not None:
+            for n in node.args:
+                if isinstance(n, ast.Starred):
+                    break
+                self._check(n)
+            else:
+                # np.log10 is evaluated as log10
+                node.func = ast.copy_location(ast.Name(id=self._function(node.func), ctx=ast.Load()), node.func)
+                return
+        part = self.text[node.col_offset:node.end_col_offset]
+        raise ValueError('%s: %r is not allowed in %r' % (self.name, part, self.text))
+
+    @staticmethod
+    def _function(node):
+        """the name of the whitelisted function node refers to, or None"""
+        if isinstance(node, ast.Name) and node.id in FUNCTIONS:
+            return node.id
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+                and node.value.id in ('np', 'numpy') and node.attr in FUNCTIONS:
+            return node.attr
+        return None
+
+    def evaluate(self, columns):
+        """returns the float64 values of the expression for columns, a mapping of name -> array"""
+        missing = self.names - set(columns)
+        if missing:
+            raise ValueError('%s: unknown column %s in %r' % (self.name, ', '.join(sorted(missing)), self.text))
+        n = len(next(iter(columns.values()))) if columns else 0
+        namespace = dict(CONSTANTS, **FUNCTIONS)
+        namespace.update((c, np.asarray(columns[c], dtype=np.float64)) for c in self.names)
+        with np.errstate(all='ignore'):
+            values = np.asarray(eval(self._code, {'__builtins__': {}}, namespace), dtype=np.float64)
+        if values.shape != (n,):
+            # an expression without columns, e.g. '2*pi'
+            values = np.full(n, values)
+        return values
+
+
+def compile_expressions(expressions):
+    """compiles a mapping of name -> expression text (kept in order) into a list of Expressions"""
+    return [Expression(name, text) for name, text in expressions.items()]
+
+
+def required_columns(compiled):
+    """the log file columns the compiled expressions need, i.e. the names they use that are not
+        defined by an earlier expression"""
+    defined, needed = set(), []
+    for e in compiled:
+        needed += sorted(n for n in e.names - defined if n not in needed)
+        defined.add(e.name)
+    return needed
+
+
+def evaluate_expressions(compiled, data):
+    """returns an OrderedDict of name -> values of the compiled expressions evaluated on data,
+        a mapping of column name -> array. each expression sees the ones before it"""
+    columns = dict(data)
+    derived = OrderedDict()
+    for e in compiled:
+        derived[e.name] = columns[e.name] = e.evaluate(columns)
+    return derived
@@ -0,0 +1,25 @@
+#!/usr/bin/python3
+# Bokeh server app that follows MESA runs while they are running:
+#   bokeh serve follow_app.py --args models/single/10/ [--mode binary] [--interval 2] [--rollover 100000]
+# the plot is built once from the history files, then every interval seconds only the rows MESA
+# appended since are parsed and streamed to the page
+import argparse
+from bokeh.io import curdoc
+from IMP import iMESAplotter
+
+parser = argparse.ArgumentParser(description='Follow MESA history files in a Bokeh server app.')
+parser.add_argument('dirs', nargs='+', help='run directory (several for mode multiple)')
+parser.add_argument('--mode', default='single', choices=['single', 'binary', 'multiple'])
+parser.add_argument('--x-qual', default='log_Teff')
+parser.add_argument('--y-qual', default='log_L')
+parser.add_argument('--interval', type=float, default=2., help='seconds between checks for new rows')
+parser.add_argument('--rollover', type=int, default=None, help='maximum number of rows kept per track')
+args = parser.parse_args()
+
+mp = iMESAplotter(args.dirs if args.mode == 'multiple' else args.dirs[0], mode=args.mode, follow=True)
+mp.make_plot(x_qual=args.x_qual, y_qual=args.y_qual)
+
+doc = curdoc()
+doc.title = 'MESA Model (following)'
+doc.add_root(mp.layout)
+doc.add_periodic_callback(lambda: mp.stream_new_rows(rollover=args.rollover), int(args.interval * 1000))
@@ -0,0 +1,150 @@
+"""Persistent on-disk cache of parsed MESA log files.
+
+Each log file gets its own entry directory (named by a hash of its absolute
+path) holding one .npy file per bulk column and a meta.json with the header
+values, the column names and the path, mtime and size of the log file when it
+was parsed. An entry is only used if the path, mtime and size still match, so
+runs that are still going or have been rerun are parsed again. Columns are
+read back through memory mapping, so a hit costs little more than opening the
+files. Derived quantities (see expressions.py) evaluated on a file are stored
+in its entry as well, one .npy file each, and are dropped with the entry.
+"""
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from history_reader import read_history
+from expressions import required_columns
+
+META_FILE = 'meta.json'
+
+
+class HistoryCache:
+    def __init__(self, directory):
+        self.dir = directory
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _entry_dir(self, file):
+        key = hashlib.sha1(os.path.abspath(file).encode()).hexdigest()
+        return os.path.join(self.dir, key)
+
+    def _stamp(self, file):
+        """the values an entry is keyed and invalidated by"""
+        st = os.stat(file)
+        return {'path': os.path.abspath(file), 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+    def _meta(self, file):
+        """the meta data of the entry of file, or None if there is no entry or it is out of date"""
+        try:
+            with open(os.path.join(self._entry_dir(file), META_FILE)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta['stamp'] != self._stamp(file):
+            return None
+        return meta
+
+    def is_fresh(self, file):
+        """whether reading file would be a cache hit"""
+        return self._meta(file) is not None
+
+    def get(self, file, columns=None):
+        """returns (header, data) for file from the cache, or None if there is
+            no entry or the entry is out of date"""
+        entry = self._entry_dir(file)
+        meta = self._meta(file)
+        if meta is None:
+            return None
+
+        index = {n: i for i, n in enumerate(meta['columns'])}
+        if columns is None:
+            columns = meta['columns']
+        # numpy cannot memory map an empty array
+        mmap_mode = 'r' if meta['rows'] > 0 else None
+        data = OrderedDict()
+        for c in columns:
+            if c in index:
+                data[c] = np.load(os.path.join(entry, 'c%s.npy' % index[c]), mmap_mode=mmap_mode)
+        return OrderedDict(meta['header']), data
+
+    def put(self, file, header, data, stamp=None):
+        """stores a parsed log file. stamp should be taken before the file was
+            parsed, so that a file changed while parsing is not marked fresh"""
+        if stamp is None:
+            stamp = self._stamp(file)
+        entry = self._entry_dir(file)
+        os.makedirs(entry, exist_ok=True)
+        # invalidate the old entry before its column files are overwritten
+        if os.path.exists(os.path.join(entry, META_FILE)):
+            os.remove(os.path.join(entry, META_FILE))
+        # derived quantities of the old version of the file
+        for f in os.listdir(entry):
+            if f.startswith('d') and f.endswith('.npy'):
+                os.remove(os.path.join(entry, f))
+        columns = list(data)
+        for i, c in enumerate(columns):
+            np.save(os.path.join(entry, 'c%s.npy' % i), np.asarray(data[c], dtype=np.float64))
+        meta = {'stamp': stamp, 'header': list(header.items()), 'columns': columns,
+                'rows': len(data[columns[0]]) if columns else 0}
+        # meta.json is written last and atomically, so a half written entry is never used
+        tmp = os.path.join(entry, META_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(entry, META_FILE))
+
+    def derived(self, file, expressions, data):
+        """returns an OrderedDict of the values of the compiled expressions on data (all rows of
+            file), loaded from the entry of file if they were evaluated before and stored otherwise.
+            the entry must be up to date"""
+        entry = self._entry_dir(file)
+        columns = dict(data)
+        n = len(next(iter(data.values()))) if data else 0
+        derived = OrderedDict()
+        # keyed by the expression and the ones before it, which it may use
+        key = hashlib.sha1()
+        for e in expressions:
+            key.update(('%s=%s\n' % (e.name, e.text)).encode())
+            path = os.path.join(entry, 'd%s.npy' % key.hexdigest())
+            try:
+                values = np.load(path, mmap_mode='r' if n > 0 else None)
+            except (OSError, ValueError):
+                values = e.evaluate(columns)
+                with open(path + '.tmp', 'wb') as f:
+                    np.save(f, values)
+                os.replace(path + '.tmp', path)
+            derived[e.name] = columns[e.name] = values
+        return derived
+
+    def read_history(self, file, columns=None, rows=None, expressions=None):
+        """drop-in replacement for history_reader.read_history that goes through
+            the cache. On a miss every column is parsed and stored, so a later
+            call asking for different columns is still a hit. A RowFilter rows is
+            applied to the memory mapped columns, so only the kept rows are copied
+            (on a miss the whole file is in memory while it is stored).
+            expressions: optional list of compiled derived quantities, returned after the
+            columns and stored in the entry, so they are evaluated once per version of the file"""
+        expressions = expressions or []
+        needed = columns
+        if columns is not None:
+            extra = (rows.columns if rows is not None else []) + required_columns(expressions)
+            needed = list(columns) + [c for c in OrderedDict.fromkeys(extra) if c not in columns]
+        cached = self.get(file, needed)
+        if cached is not None:
+            header, data = cached
+        else:
+            stamp = self._stamp(file)
+            header, data = read_history(file)
+            self.put(file, header, data, stamp=stamp)
+            if needed is not None:
+                data = OrderedDict((c, data[c]) for c in needed if c in data)
+        if expressions:
+            data.update(self.derived(file, expressions, data))
+        if rows is not None:
+            data = rows.apply(data)
+        if columns is not None:
+            keep = list(columns) + [e.name for e in expressions]
+            data = OrderedDict((c, data[c]) for c in keep if c in data)
+        return header, data
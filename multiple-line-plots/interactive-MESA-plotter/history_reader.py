@@ -0,0 +1,248 @@
+"""Fast reader for MESA log files (history.data, binary_history.data).
+
+A MESA log file has a short header section (column numbers, header names and
+header values on lines 1-3) followed by the bulk section (column numbers and
+names on lines 5-6, then one row per saved model). Both sections are read in a
+single pass over the file. The bulk section is parsed by numpy's C tokenizer
+straight into float64 columns, so there is no per-cell type inference as with
+np.genfromtxt, and columns that were not asked for are never converted.
+
+For very large files, read_header gives the column names without touching the
+bulk section, and a RowFilter makes read_history parse the bulk section in
+chunks, keeping only the selected rows of each chunk, so memory use is bounded
+by the size of the result rather than the size of the file.
+"""
+import io
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+HEADER_NAMES_LINE = 2
+BULK_NAMES_LINE = 6
+# bytes of the bulk section parsed at a time when rows are filtered
+CHUNK_BYTES = 1 << 20
+
+# a header value is either a quoted string (which may contain spaces) or a number
+_header_token = re.compile(r'"[^"]*"|\S+')
+
+
+def _parse_header_value(token):
+    """converts a single header token to str, int or float without using eval"""
+    if token.startswith('"'):
+        return token[1:-1]
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        # fortran double precision exponents may be written with a D
+        return float(token.replace('D', 'E').replace('d', 'e'))
+    except ValueError:
+        return token
+
+
+def parse_header(names_line, values_line):
+    """returns an OrderedDict of header name -> value from the two header lines"""
+    names = names_line.split()
+    values = [_parse_header_value(t) for t in _header_token.findall(values_line)]
+    return OrderedDict(zip(names, values))
+
+
+def _read_head(f):
+    """reads the header section from the open file f. returns (header, bulk column names)"""
+    lines = [f.readline() for i in range(BULK_NAMES_LINE)]
+    header = parse_header(lines[HEADER_NAMES_LINE - 1].decode(), lines[HEADER_NAMES_LINE].decode())
+    return header, lines[BULK_NAMES_LINE - 1].decode().split()
+
+
+def read_header(file):
+    """returns (header, bulk column names) of a MESA log file without reading its bulk section"""
+    with open(file, 'rb') as f:
+        return _read_head(f)
+
+
+class RowFilter:
+    """selects the rows of a log file to keep.
+
+        ranges: dict of column name -> (low, high). a row is kept if low <= value <= high for
+                every column; either bound may be None. e.g. {'star_age': (1e6, None)}
+        every: keep every n-th of the rows that are in the ranges (the first one included)"""
+
+    def __init__(self, ranges=None, every=1):
+        self.ranges = OrderedDict(ranges or {})
+        self.every = int(every)
+        if self.every < 1:
+            raise ValueError('every must be at least 1')
+
+    @property
+    def columns(self):
+        """the columns the filter needs"""
+        return list(self.ranges)
+
+    def select(self, data, counted=0):
+        """returns (mask of the rows of data to keep, rows in the ranges so far).
+            data maps column name -> array, counted is the number of rows in the ranges before data,
+            so that every is counted across the chunks of a file"""
+        missing = [c for c in self.ranges if c not in data]
+        if missing:
+            raise ValueError('no column %s to filter rows by' % ', '.join(missing))
+        n = len(next(iter(data.values())))
+        keep = np.ones(n, dtype=bool)
+        for c, (low, high) in self.ranges.items():
+            if low is not None:
+                keep &= data[c] >= low
+            if high is not None:
+                keep &= data[c] <= high
+        in_ranges = np.cumsum(keep)
+        if self.every > 1:
+            keep &= (counted + in_ranges - 1) % self.every == 0
+        return keep, counted + (int(in_ranges[-1]) if n else 0)
+
+    def apply(self, data):
+        """returns an OrderedDict of the kept rows of every column of data"""
+        keep = self.select(data)[0]
+        return OrderedDict((c, np.asarray(v)[keep]) for c, v in data.items())
+
+
+def _parse_bulk(f, usecols):
+    """parses the bulk section from the current position of the open file f
+        into a (rows, len(usecols)) float64 array, converting only usecols"""
+    start = f.tell()
+    try:
+        return np.loadtxt(f, dtype=np.float64, usecols=usecols, ndmin=2)
+    except ValueError:
+        # malformed rows or fortran overflow fields (*****): fall back to the
+        # slow but forgiving parser, which fills bad fields with nan
+        f.seek(start)
+        values = np.genfromtxt(f, dtype=np.float64, usecols=usecols, invalid_raise=False)
+        return values.reshape(-1, len(usecols))
+
+
+def _parse_bulk_filtered(f, names, columns, rows, chunk_bytes):
+    """parses the bulk section from the current position of the open file f chunk by chunk,
+        keeping only the rows selected by the RowFilter rows. returns an OrderedDict of columns"""
+    missing = [c for c in rows.columns if c not in names]
+    if missing:
+        raise ValueError('%s has no column %s to filter rows by' % (f.name, ', '.join(missing)))
+    parsed = columns + [c for c in rows.columns if c not in columns]
+    usecols = [names.index(c) for c in parsed]
+    pieces = [[] for c in columns]
+    counted, rest = 0, b''
+    while True:
+        block = f.read(chunk_bytes)
+        text = rest + block
+        # a chunk ends at the last complete row, the rest goes into the next chunk
+        cut = text.rfind(b'\n') + 1 if block else len(text)
+        text, rest = text[:cut], text[cut:]
+        if text.strip():
+            bulk = _parse_bulk(io.BytesIO(text), usecols)
+            keep, counted = rows.select({c: bulk[:, i] for i, c in enumerate(parsed)}, counted)
+            for i in range(len(columns)):
+                pieces[i].append(bulk[keep, i])
+        if not block:
+            break
+    data = OrderedDict()
+    for i, c in enumerate(columns):
+        data[c] = np.concatenate(pieces[i]) if pieces[i] else np.empty(0)
+        pieces[i] = None
+    return data
+
+
+def read_history(file, columns=None, rows=None, chunk_bytes=CHUNK_BYTES):
+    """reads a MESA log file.
+
+        columns: optional list of bulk column names to return. Names not in
+                 the file are skipped. If None, all columns are returned.
+        rows: optional RowFilter. The bulk section is then parsed chunk_bytes
+              at a time and only the selected rows are kept.
+
+        returns (header, data) where header is an OrderedDict of header
+        values and data is an OrderedDict of column name -> float64 array"""
+    with open(file, 'rb') as f:
+        header, names = _read_head(f)
+
+        if columns is None:
+            columns = names
+        else:
+            columns = [c for c in columns if c in names]
+        if rows is not None:
+            return header, _parse_bulk_filtered(f, names, columns, rows, chunk_bytes)
+        usecols = [names.index(c) for c in columns]
+        bulk = _parse_bulk(f, usecols)
+
+    data = OrderedDict()
+    for i, c in enumerate(columns):
+        data[c] = np.ascontiguousarray(bulk[:, i])
+    return header, data
+
+
+def drop_overwritten(model_number):
+    """returns a boolean mask of the rows to keep when MESA was restarted from an earlier model.
+        after a restart MESA appends rows starting again from the restart model, so a row is kept
+        only if every later row has a higher model number"""
+    model_number = np.asarray(model_number)
+    if len(model_number) == 0:
+        return np.ones(0, dtype=bool)
+    later_min = np.minimum.accumulate(model_number[::-1])[::-1]
+    return np.append(model_number[:-1] < later_min[1:], True)
+
+
+class HistoryFollower:
+    """follows a MESA log file that is still being written. Each call to read parses only the
+        rows appended since the previous call, starting from the remembered byte offset"""
+
+    def __init__(self, file, columns=None):
+        self.file = file
+        self.columns = columns
+        self.header = None
+        self.names = None
+        self.offset = 0
+        self._head = None
+        self._inode = None
+
+    def _read_head(self, f):
+        """parses the header section; returns False if it is not completely written yet"""
+        lines = [f.readline() for i in range(BULK_NAMES_LINE)]
+        if not lines[-1].endswith(b'\n'):
+            return False
+        self._head = b''.join(lines)
+        self.header = parse_header(lines[HEADER_NAMES_LINE - 1].decode(), lines[HEADER_NAMES_LINE].decode())
+        self.names = lines[BULK_NAMES_LINE - 1].decode().split()
+        if self.columns is not None:
+            self.columns = [c for c in self.columns if c in self.names]
+        else:
+            self.columns = list(self.names)
+        self.offset = f.tell()
+        return True
+
+    def read(self):
+        """returns (data, restarted). data is an OrderedDict of column name -> float64 array of the
+            new rows. restarted is True on the first call and whenever the file was replaced or
+            truncated; data then holds all rows of the file"""
+        st = os.stat(self.file)
+        with open(self.file, 'rb') as f:
+            restarted = (self.names is None or st.st_ino != self._inode or st.st_size < self.offset
+                         or f.read(len(self._head)) != self._head)
+            if restarted:
+                f.seek(0)
+                if not self._read_head(f):
+                    self.names = None
+                    return OrderedDict(), True
+                self._inode = st.st_ino
+            f.seek(self.offset)
+            chunk = f.read()
+        # a partly written last row is left for the next call
+        chunk = chunk[:chunk.rfind(b'\n') + 1]
+        self.offset += len(chunk)
+
+        usecols = [self.names.index(c) for c in self.columns]
+        if chunk.strip():
+            bulk = _parse_bulk(io.BytesIO(chunk), usecols)
+        else:
+            bulk = np.empty((0, len(usecols)))
+        data = OrderedDict()
+        for i, c in enumerate(self.columns):
+            data[c] = np.ascontiguousarray(bulk[:, i])
+        return data, restarted
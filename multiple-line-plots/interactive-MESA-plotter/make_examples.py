@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 from IMP import iMESAplotter
 import os
-os.system('mkdir -p examples')
+os.makedirs('examples', exist_ok=True)
 
 import bokeh
 print('bokeh version ', bokeh.__version__)
@@ -0,0 +1,121 @@
+"""Evolutionary phases of MESA tracks as row ranges.
+
+find_events locates the rows at which a track reaches the zero and terminal age
+main sequence, core helium ignition and depletion, and where Roche lobe
+overflow starts and ends. Each event is found with one vectorized pass over a
+column (a boolean mask and an argmax), so indexing a track costs a few numpy
+calls however long it is. phase_rows turns the events into the row ranges of
+the phases between them, which the plot uses to jump straight to a phase.
+
+The thresholds are module constants so they can be tuned for a grid:
+
+    import phases
+    phases.TAMS_H1 = 1e-3
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+# the main sequence starts once central hydrogen dropped by this much from its initial value
+ZAMS_H1_DROP = 1e-3
+# and ends once central hydrogen is below this
+TAMS_H1 = 1e-4
+# core helium burning starts once central helium dropped by this much from its peak after the TAMS
+HE_IGNITION_DROP = 1e-2
+# and ends once central helium is below this
+HE_DEPLETION_HE4 = 1e-3
+
+# the columns events are computed from. rl_relative_overflow_<n> is in binary_history.data and,
+# if MESA was told to log it, in the history files of the stars
+EVENT_COLUMNS = ['model_number', 'center_h1', 'center_he4', 'rl_relative_overflow_1', 'rl_relative_overflow_2']
+
+# (phase, event it starts at, event it ends at). None: the first or last row of the track
+PHASES = [('pre-MS', None, 'ZAMS'),
+          ('MS', 'ZAMS', 'TAMS'),
+          ('post-MS', 'TAMS', 'He ignition'),
+          ('core He burning', 'He ignition', 'He depletion'),
+          ('post He burning', 'He depletion', None)]
+
+
+def _first(mask, start=0):
+    """the first row at or after start where mask is True, or -1"""
+    if start < 0 or start >= len(mask):
+        return -1
+    i = start + int(np.argmax(mask[start:]))
+    return i if mask[i] else -1
+
+
+def _overflow(data, star, binary):
+    """rl_relative_overflow of star for the rows of data, or None if it is not known"""
+    column = 'rl_relative_overflow_%s' % star
+    if column in data:
+        return np.asarray(data[column])
+    if binary is None or column not in binary or 'model_number' not in binary or 'model_number' not in data \
+            or len(binary['model_number']) == 0:
+        return None
+    # rows of binary_history.data with the model numbers of the track; rows not in it do not overflow
+    model_number = np.asarray(binary['model_number'])
+    rows = np.minimum(np.searchsorted(model_number, data['model_number']), len(model_number) - 1)
+    return np.where(model_number[rows] == data['model_number'], np.asarray(binary[column])[rows], 0.)
+
+
+def find_events(data, star=1, binary=None):
+    """returns an OrderedDict of event name -> first row of the event in data, a mapping of column
+        name -> array of one track, with -1 for events the track does not reach. events whose
+        columns are not in data are left out.
+        star: which star of a binary the track belongs to, selects rl_relative_overflow_<star>
+        binary: optional columns of binary_history.data, used for the overflow if the track does not
+                log it. matched to the track by model_number"""
+    events = OrderedDict()
+    if 'center_h1' in data and len(data['center_h1']):
+        h1 = np.asarray(data['center_h1'])
+        zams = _first(h1 <= h1[0] - ZAMS_H1_DROP)
+        tams = _first(h1 < TAMS_H1, zams)
+        events['ZAMS'] = zams
+        events['TAMS'] = tams
+        if 'center_he4' in data:
+            he4 = np.asarray(data['center_he4'])
+            ignition = depletion = -1
+            if tams >= 0:
+                # central helium peaks around the end of hydrogen burning and drops once it burns
+                peak = tams + int(np.argmax(he4[tams:]))
+                ignition = _first(he4 <= he4[peak] - HE_IGNITION_DROP, peak)
+                depletion = _first(he4 < HE_DEPLETION_HE4, ignition)
+            events['He ignition'] = ignition
+            events['He depletion'] = depletion
+
+    overflow = _overflow(data, star, binary)
+    if overflow is not None and len(overflow):
+        on = overflow > 0
+        # every switch between detached and overflowing, as the first row after it
+        switches = np.flatnonzero(on[1:] != on[:-1]) + 1
+        starts = switches[on[switches]]
+        ends = switches[~on[switches]]
+        if on[0]:
+            starts = np.insert(starts, 0, 0)
+        for k, start in enumerate(starts):
+            later = ends[ends > start]
+            events['RLOF %s start' % (k + 1)] = int(start)
+            events['RLOF %s end' % (k + 1)] = int(later[0]) if len(later) else -1
+    return events
+
+
+def phase_rows(events, n):
+    """returns an OrderedDict of phase name -> (first row, stop row) of a track of n rows with the
+        events returned by find_events. a phase includes the row of the event that ends it, so
+        consecutive phases share a row; a phase whose end is not reached runs to the end of the
+        track. phases the track does not reach are left out"""
+    bounds = list(PHASES)
+    k = 1
+    while 'RLOF %s start' % k in events:
+        bounds.append(('RLOF %s' % k, 'RLOF %s start' % k, 'RLOF %s end' % k))
+        k += 1
+    rows = OrderedDict()
+    for phase, start, end in bounds:
+        first = 0 if start is None else events.get(start, -1)
+        if first < 0 or (end is not None and end not in events):
+            continue
+        last = n - 1 if end is None or events[end] < 0 else events[end]
+        if last >= first:
+            rows[phase] = (first, last + 1)
+    return rows
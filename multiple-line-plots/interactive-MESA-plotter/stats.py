@@ -0,0 +1,97 @@
+"""Timing and size statistics of building a page.
+
+make_plot and save_plot fill in iMESAplotter.stats, a PlotStats, with the time
+spent in each stage, the size of every history file and of every source in
+the plot, and the bytes each column adds to the page. Pass stats_callback to
+iMESAplotter to export them when a page is saved, e.g. to flag oversized pages
+of a grid:
+
+    def log_stats(stats):
+        logging.info(stats.summary())
+        if stats.page_bytes > 50e6:
+            logging.warning('large page: %s', json.dumps(stats.as_dict()))
+"""
+import time
+import json
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def payload_bytes(values):
+    """bytes a column of a ColumnDataSource adds to the page script. numeric arrays are embedded
+        base64 encoded, lists of them (multi_line xs/ys) as one such array each, the rest as json"""
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        return 4 * ((values.nbytes + 2) // 3)
+    values = list(values)
+    if values and all(isinstance(v, np.ndarray) for v in values):
+        return sum(payload_bytes(v) for v in values)
+    return len(json.dumps(values, default=lambda v: v.tolist() if hasattr(v, 'tolist') else str(v)))
+
+
+class PlotStats:
+    """what building a page took and produced.
+
+        timers: stage -> seconds. parse (load_history_files), build (the rest of make_plot),
+                serialize (components), render (html template) and write
+        files: per history file, OrderedDict(file, rows, columns, cache_hit). cache_hit is None
+               without a cache
+        sources: per ColumnDataSource of the plot, OrderedDict(name, rows, columns, bytes)
+        column_bytes: column -> bytes it adds to the page script, over all sources. columns of
+                      the named index sources (shared_columns, lazy_columns, ...) are listed as
+                      <source name>.<column>
+        page_bytes: size of the saved page, None until it is saved"""
+
+    def __init__(self):
+        self.timers = OrderedDict()
+        self.files = []
+        self.sources = []
+        self.column_bytes = OrderedDict()
+        self.page_bytes = None
+
+    @contextmanager
+    def timer(self, stage):
+        """times the code run inside the with block as stage"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[stage] = time.perf_counter() - t0
+
+    def measure_sources(self, sources):
+        """records the rows, columns and payload of sources, the ColumnDataSources of a layout"""
+        self.sources = []
+        self.column_bytes = OrderedDict()
+        for s in sources:
+            rows = len(next(iter(s.data.values()))) if s.data else 0
+            size = 0
+            for c, values in s.data.items():
+                n = payload_bytes(values)
+                key = '%s.%s' % (s.name, c) if s.name else c
+                self.column_bytes[key] = self.column_bytes.get(key, 0) + n
+                size += n
+            self.sources.append(OrderedDict([('name', s.name), ('rows', rows), ('columns', len(s.data)),
+                                             ('bytes', size)]))
+
+    def as_dict(self):
+        """the statistics as plain python types, e.g. for json.dumps"""
+        return OrderedDict([('timers', OrderedDict(self.timers)), ('files', [OrderedDict(f) for f in self.files]),
+                            ('sources', [OrderedDict(s) for s in self.sources]),
+                            ('column_bytes', OrderedDict(self.column_bytes)), ('page_bytes', self.page_bytes)])
+
+    def summary(self, top=5):
+        """one line: the stage times, rows loaded, page size and the top columns by bytes"""
+        parts = ['%s %.3f s' % (stage, t) for stage, t in self.timers.items()]
+        rows = sum(f['rows'] for f in self.files)
+        hits = [f['cache_hit'] for f in self.files if f['cache_hit'] is not None]
+        files = '%s files, %s rows' % (len(self.files), rows)
+        if hits:
+            files += ', %s/%s cached' % (sum(hits), len(hits))
+        parts.append(files)
+        if self.page_bytes is not None:
+            parts.append('page %.1f kB' % (self.page_bytes / 1e3))
+        largest = sorted(self.column_bytes.items(), key=lambda kv: -kv[1])[:top]
+        if largest:
+            parts.append('largest columns: ' + ', '.join('%s %.1f kB' % (c, n / 1e3) for c, n in largest))
+        return '; '.join(parts)
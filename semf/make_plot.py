@@ -2,15 +2,16 @@
 
 #################################
 # This script produces an interactive plot to explore the semi-empirical mass formula through varying the constants in the formula
+#   python make_plot.py                            SEMF.html of N = 1..100, Z = 1..100
+#   python make_plot.py --grid 180x120 300x300     SEMF_N180_Z120.html and SEMF_N300_Z300.html, one page per N x Z
 ##################################
+import argparse
 import numpy as np
 
-from bokeh.io import curdoc
 from bokeh.layouts import column, row
-from bokeh.models import ColumnDataSource, Slider,  Button , ColorBar, LinearColorMapper
-from bokeh.plotting import figure
-from bokeh.models import CustomJS, Slider, CheckboxGroup, Div, Select, Button, LinearAxis, Label
-from bokeh.plotting import ColumnDataSource, figure, output_file, save
+from bokeh.models import ColumnDataSource, Slider, Button, ColorBar, LinearColorMapper, CustomJS, LinearAxis
+from bokeh.plotting import figure, output_file, save
+from semf_basis import SEMFBasis
 
 # Set up data
 aV0=15.8
@@ -20,152 +21,263 @@ aA0=23.2
 aP0=12
 kP0=0.5
 value_list=[ aV0, aS0, aC0, aA0, aP0, kP0]
-def binding_E(Z,N, aV=aV0, aS=aS0, aC=aC0, aA=aA0, aP=aP0, kP=kP0):
-    A=Z+N
-    
-    q=aV* A
-    w=- aS*A**(2/3.0)
-    e=- aC* (Z*(Z-1))* A**(-1/3.0)
-    r= - aA *(A- 2*Z)**2 /A
-    
-    Zint= (np.rint(Z)).astype(int)
-    Nint= (np.rint(N)).astype(int)
-    
-    sgn = np.zeros(Zint.shape)
-    sgn[(Zint%2==0) & (Nint%2==0)] = +1
-    sgn[(Zint%2!=0) & (Nint%2!=0)] = -1
-    t= sgn * aP*A**-float(kP)
-    
-    return (q+w+e+r+t)/A
-
-
-
-x= np.arange(1,101,1)
-y= np.arange(1,101,1)
-X, Y = np.meshgrid(x, y)
-E0= binding_E(N=X,Z=Y)
-E0[E0<0] = 0
-
-source0 = ColumnDataSource({'image': [E0], 'x0':[x[0]], 'y0':[y[0]], 'dw':[x[-1]],'dh':[y[-1]] })
-
-source = ColumnDataSource({'image': [E0], 'x0':[x[0]], 'y0':[y[0]], 'dw':[x[-1]],'dh':[y[-1]] })
-
-# Set up plot
-p = figure(y_range=(y[0],y[-1]), x_range=(x[0],x[-1]), plot_width=800, plot_height=550,
-           tooltips=[("x", "$x"), ("y", "$y"), ("value", "@image")], toolbar_location=None, tools=['reset'])
-p.xgrid.visible = False
-p.ygrid.visible = False
-p.xaxis.axis_label= 'N= neutron number'
-p.yaxis.axis_label= 'Z= proton number'
-p.yaxis.axis_label_text_font_style = "bold"
-p.xaxis.axis_label_text_font_style = "bold"
-p.add_layout(LinearAxis(major_label_text_color=None), 'right')
-p.add_layout(LinearAxis(major_label_text_color=None), 'above')
-
-color_mapper = LinearColorMapper(palette="Viridis256", low=0, high=12.1)
-p.image(image='image', x='x0', y='y0',  dw='dw', dh='dh', source=source,color_mapper=color_mapper) #palette='Viridis256'
-#p.image(image=[E], x=x[0], y=y[0], dw=[100], dh=[100], palette='Viridis256')
-p.line(x,y,  visible=True,line_width=2., line_color='white')
-
-# Set up widgets
-reset_button= Button(label='Reset', height=40, width=150)
-calc_button= Button(label='Calculate', height=40, width=150)
-av_slider = Slider(title="Volume constant/MeV", value=aV0, start=0, end=50, step=1)
-as_slider = Slider(title="Surface constant/MeV", value=aS0, start=0, end=50, step=1)
-ac_slider = Slider(title="Coulomb constant/MeV", value=aC0, start=0.0, end=5, step=0.1)
-aa_slider = Slider(title="Asymmetry constant/MeV", value=aA0, start=0, end=50, step=1)
-ap_slider = Slider(title="Pairing energy constant/MeV", value=aP0, start=0, end=50, step=1)
-kp_slider = Slider(title="Pairing energy exponent", value=kP0, start=0, end=2, step=0.1)
-slider_list=[av_slider, as_slider, ac_slider, aa_slider,ap_slider, kp_slider]
-
-# Set up callbacks
-
-#callback for reset button. sets all sliders to original values and resets binding energies 
-reset_call = CustomJS(args=dict(source=source, slider_list=slider_list,value_list=value_list, E0=E0, source0=source0),
-                    code="""
-                            const data= source.data;
-                            const E = data['image'];
-                            const N_max = data['dw'];
-                            const Z_max = data['dh'];
-
-                            for (var N = 0; N < value_list.length; N++) {
-                            slider_list[N].value= value_list[N]}
-                            const av_i = value_list[0];
-                            const as_i = value_list[1];
-                            const ac_i = value_list[2];
-                            const aa_i = value_list[3];
-                            const ap_i = value_list[4];
-                            const kp_i = value_list[5];
-                            for (var N = 0; N < N_max; N++) {
-                                for (var Z = 0; Z < Z_max; Z++) {
-                                const A= N+Z;
-                                var sgn = 0;
-                                if ((N % 2 == 0) && (Z % 2 == 0)){
-                                    sgn = 1;}
-                                if ((N % 2 != 0) && (Z % 2 != 0)){
-                                    sgn = -1;}
-                                const e_val = Math.max(0 , (av_i * A - as_i *A **(2/3.0) - ac_i* (Z*(Z-1))* A**(-1/3.0) -  aa_i *(A- 2*Z)**2 /A + sgn * ap_i*A**(-kp_i))/ A);
-                                E[0][Z*N_max + N] = e_val;
-                                }
-                            }
-                            source.change.emit();
-""")
-reset_button.js_on_click( reset_call)
-
-
-#callback for calculate button. reads the values of all sliders and recalculates binding energies 
-calc_call = CustomJS(args=dict(source=source, slider_list=slider_list),
-                    code="""
-                            const data= source.data;
-                            const E = data['image'];
-                            const N_max = data['dw'];
-                            const Z_max = data['dh'];
-
-                            console.log('######');
-                            const av_i = slider_list[0].value;
-                            const as_i = slider_list[1].value;
-                            const ac_i = slider_list[2].value;
-                            const aa_i = slider_list[3].value;
-                            const ap_i = slider_list[4].value;
-                            const kp_i = slider_list[5].value;
-
-                            for (var N = 0; N< N_max; N++) {
-                                for (var Z = 0; Z < Z_max; Z++) {
-                                const A= N+Z;
-                                var sgn = 0;
-                                if ((N % 2 == 0) && (Z % 2 == 0)){
-                                    sgn = 1;}
-                                if ((N % 2 != 0) && (Z % 2 != 0)){
-                                    sgn = -1;}
-                                const e_val = Math.max(0 , (av_i * A - as_i *A **(2/3.0) - ac_i* (Z*(Z-1))* A**(-1/3.0) -  aa_i *(A- 2*Z)**2 /A + sgn * ap_i*A**(-kp_i))/ A);
-                                E[0][Z*N_max + N] = e_val;
-                                }
-                            }
-                            source.change.emit();
-                            """)
-calc_button.js_on_click( calc_call)
-
-
-
-#add colour bar
-color_bar_height = 550 + 0
-color_bar_width = 120
-color_bar = ColorBar(color_mapper=color_mapper, 
-                     label_standoff=12, border_line_color=None, location=(0,0))
-color_bar_plot = figure(title="Binding energy per nucleon/MeV", title_location="right", 
-                        height=color_bar_height, width=color_bar_width, 
-                        toolbar_location=None, min_border=0, 
-                        outline_line_color=None)
-color_bar_plot.add_layout(color_bar, 'right')
-color_bar_plot.title.align="center"
-color_bar_plot.title.text_font_size = '12pt'
-
-# Set up layouts 
-inputs = column(row(calc_button,reset_button), av_slider, as_slider, ac_slider, aa_slider, ap_slider, kp_slider)
-layout = row(inputs, p,color_bar_plot,  width=800)
-
-print("saving file")
-output_file("SEMF.html", title="SEMF")
-save(layout)
 
 
+# the binding energies are recomputed in a Web Worker while a slider is dragged. semf_engine is the JS
+# side of SEMFBasis: it keeps the basis images, built from tables of the powers of A, the pairing
+# images of the last 32 kP values, and the weighted sum of the images with the current constants.
+# a slider only adds (new - old constant) * its image to the sum. the worker fills an image buffer that is
+# transferred to the page and back, and only one computation runs at a time: slider values that
+# arrive meanwhile are merged, and the latest is computed next. if no worker can be started (e.g.
+# browsers that block them on file:// pages) the engine runs in the page instead
+SEMF_JS = """
+function semf_engine(N, Z) {
+    // N: neutron numbers of the image columns, Z: proton numbers of its rows
+    const nx = N.length, ny = Z.length, size = nx * ny;
+    let A_max = 0;
+    for (const n of N) for (const z of Z) A_max = Math.max(A_max, n + z);
+    const inv_A = new Float64Array(A_max + 1), cbrt_inv_A = new Float64Array(A_max + 1);
+    for (let a = 1; a <= A_max; a++) {
+        inv_A[a] = 1 / a;
+        cbrt_inv_A[a] = a ** (-1 / 3);
+    }
+    const pow_kP = new Float64Array(A_max + 1);
+    const A = new Int32Array(size), sgn = new Int8Array(size);
+    // terms of aV, aS, aC, aA
+    const terms = [new Float64Array(size), new Float64Array(size), new Float64Array(size), new Float64Array(size)];
+    for (let i = 0; i < ny; i++) {
+        for (let j = 0; j < nx; j++) {
+            const k = i * nx + j, z = Z[i], a = N[j] + z;
+            if (a <= 0) continue;
+            A[k] = a;
+            sgn[k] = (z % 2 == 0 && N[j] % 2 == 0) ? 1 : (z % 2 != 0 && N[j] % 2 != 0) ? -1 : 0;
+            terms[0][k] = 1;
+            terms[1][k] = -cbrt_inv_A[a];
+            terms[2][k] = -z * (z - 1) * cbrt_inv_A[a] * inv_A[a];
+            terms[3][k] = -((a - 2 * z) ** 2) * inv_A[a] * inv_A[a];
+        }
+    }
+    // pairing images of the last kP values, as SEMFBasis.pairing, and the sum of all terms times the
+    // current constants
+    const pairing_images = new Map(), sum = new Float64Array(size);
+    let T_P = null, c = null, updates = 0;
+
+    function pairing(kP) {
+        let T = pairing_images.get(kP);
+        if (T === undefined) {
+            for (let a = 1; a <= A_max; a++) pow_kP[a] = a ** (-kP) * inv_A[a];
+            T = new Float64Array(size);
+            for (let k = 0; k < size; k++) T[k] = sgn[k] * pow_kP[A[k]];
+            if (pairing_images.size >= 32) pairing_images.delete(pairing_images.keys().next().value);
+        } else {
+            pairing_images.delete(kP);
+        }
+        pairing_images.set(kP, T);
+        return T;
+    }
+
+    // fills out with the binding energies per nucleon of the constants [aV, aS, aC, aA, aP, kP]
+    function update(constants, out) {
+        // the sum drifts by rounding as terms are added and taken away: start again now and then
+        if (c === null || ++updates % 1000 == 0) {
+            T_P = pairing(constants[5]);
+            const [aV, aS, aC, aA] = constants, aP = constants[4];
+            const [T_V, T_S, T_C, T_A] = terms;
+            for (let k = 0; k < size; k++) sum[k] = aV * T_V[k] + aS * T_S[k] + aC * T_C[k] + aA * T_A[k] + aP * T_P[k];
+        } else {
+            // a slider changes one constant: one multiply-add per nucleus
+            for (let t = 0; t < 4; t++) {
+                const d = constants[t] - c[t], T = terms[t];
+                if (d == 0) continue;
+                for (let k = 0; k < size; k++) sum[k] += d * T[k];
+            }
+            if (constants[5] != c[5]) {
+                const T_old = T_P, aP_old = c[4], aP = constants[4];
+                T_P = pairing(constants[5]);
+                for (let k = 0; k < size; k++) sum[k] += aP * T_P[k] - aP_old * T_old[k];
+            } else if (constants[4] != c[4]) {
+                const d = constants[4] - c[4];
+                for (let k = 0; k < size; k++) sum[k] += d * T_P[k];
+            }
+        }
+        c = constants.slice();
+        for (let k = 0; k < size; k++) out[k] = Math.max(0, sum[k]);
+        return out;
+    }
+    return {update: update};
+}
+
+const WORKER_MAIN = `
+let engine = null;
+onmessage = function (e) {
+    const m = e.data;
+    if (m.N) engine = semf_engine(m.N, m.Z);
+    const out = engine.update(m.constants, new Float32Array(m.buffer));
+    postMessage({buffer: out.buffer}, [out.buffer]);
+};`;
+
+// the controller of source, made by the first callback that needs it
+function semf_controller(source, N, Z) {
+    if (source._semf) return source._semf;
+    const ctl = source._semf = {busy: false, pending: null, current: null, worker: null, engine: null, started: false};
+    // the image is float32, the sums behind it float64
+    ctl.spare = new Float32Array(source.data.image[0].length).buffer;
+
+    function show(buffer) {
+        const img = source.data.image[0];
+        // the image shown until now is filled next time, unless it is still the one of the page
+        if (img.byteOffset == 0 && img.buffer.byteLength == buffer.byteLength) ctl.spare = img.buffer;
+        else ctl.spare = new Float32Array(img.length).buffer;
+        source.data.image = [new img.constructor(buffer, img.shape)];
+        source.change.emit();
+        ctl.busy = false;
+        if (ctl.pending !== null) {
+            const constants = ctl.pending;
+            ctl.pending = null;
+            ctl.request(constants);
+        }
+    }
+
+    // a worker that fails, to start or on a request, is dropped and the image computed here. the
+    // buffer of the request in flight went to the worker, so it is replaced and the request made again
+    function fall_back() {
+        if (ctl.worker) ctl.worker.terminate();
+        ctl.worker = null;
+        ctl.engine = semf_engine(N, Z);
+        ctl.spare = new Float32Array(source.data.image[0].length).buffer;
+        const constants = ctl.pending !== null ? ctl.pending : (ctl.busy ? ctl.current : null);
+        ctl.busy = false;
+        ctl.pending = null;
+        if (constants !== null) ctl.request(constants);
+    }
+
+    try {
+        const url = URL.createObjectURL(new Blob([semf_engine.toString(), WORKER_MAIN], {type: 'text/javascript'}));
+        ctl.worker = new Worker(url);
+        ctl.worker.onmessage = (e) => show(e.data.buffer);
+        ctl.worker.onerror = ctl.worker.onmessageerror = fall_back;
+    } catch (err) {
+        fall_back();
+    }
+
+    ctl.request = function (constants) {
+        if (ctl.busy) {
+            ctl.pending = constants;
+            return;
+        }
+        ctl.busy = true;
+        ctl.current = constants;
+        const buffer = ctl.spare;
+        if (ctl.worker) {
+            const m = {constants: constants, buffer: buffer};
+            if (!ctl.started) {
+                m.N = Array.from(N);
+                m.Z = Array.from(Z);
+                ctl.started = true;
+            }
+            ctl.worker.postMessage(m, [buffer]);
+        } else {
+            setTimeout(() => show(ctl.engine.update(constants, new Float32Array(buffer)).buffer), 0);
+        }
+    };
+    return ctl;
+}
+"""
+
+
+def make_plot(n_max=100, z_max=100):
+    """the layout of the page of the nuclei of N = 1..n_max, Z = 1..z_max"""
+    x= np.arange(1,n_max+1,1)
+    y= np.arange(1,z_max+1,1)
+    # rows of Z, columns of N, shipped as float32
+    E0= SEMFBasis(N=x, Z=y)(*value_list).astype(np.float32)
+    np.maximum(E0, 0, out=E0)
+
+    source = ColumnDataSource({'image': [E0], 'x0':[x[0]], 'y0':[y[0]], 'dw':[len(x)],'dh':[len(y)] })
+
+    # Set up plot
+    p = figure(y_range=(y[0],y[-1]), x_range=(x[0],x[-1]), plot_width=800, plot_height=550,
+               tooltips=[("x", "$x"), ("y", "$y"), ("value", "@image")], toolbar_location=None, tools=['reset'])
+    p.xgrid.visible = False
+    p.ygrid.visible = False
+    p.xaxis.axis_label= 'N= neutron number'
+    p.yaxis.axis_label= 'Z= proton number'
+    p.yaxis.axis_label_text_font_style = "bold"
+    p.xaxis.axis_label_text_font_style = "bold"
+    p.add_layout(LinearAxis(major_label_text_color=None), 'right')
+    p.add_layout(LinearAxis(major_label_text_color=None), 'above')
+
+    color_mapper = LinearColorMapper(palette="Viridis256", low=0, high=12.1)
+    p.image(image='image', x='x0', y='y0',  dw='dw', dh='dh', source=source,color_mapper=color_mapper) #palette='Viridis256'
+    #p.image(image=[E], x=x[0], y=y[0], dw=[100], dh=[100], palette='Viridis256')
+    p.line(x,x,  visible=True,line_width=2., line_color='white')
+
+    # Set up widgets
+    reset_button= Button(label='Reset', height=40, width=150)
+    av_slider = Slider(title="Volume constant/MeV", value=aV0, start=0, end=50, step=1)
+    as_slider = Slider(title="Surface constant/MeV", value=aS0, start=0, end=50, step=1)
+    ac_slider = Slider(title="Coulomb constant/MeV", value=aC0, start=0.0, end=5, step=0.1)
+    aa_slider = Slider(title="Asymmetry constant/MeV", value=aA0, start=0, end=50, step=1)
+    ap_slider = Slider(title="Pairing energy constant/MeV", value=aP0, start=0, end=50, step=1)
+    kp_slider = Slider(title="Pairing energy exponent", value=kP0, start=0, end=2, step=0.1)
+    slider_list=[av_slider, as_slider, ac_slider, aa_slider,ap_slider, kp_slider]
+
+    # Set up callbacks
+
+    #callback for the sliders. recomputes the binding energies with the values of all sliders
+    calc_call = CustomJS(args=dict(source=source, slider_list=slider_list, N=x, Z=y),
+                        code=SEMF_JS + """
+                                semf_controller(source, N, Z).request(slider_list.map((s) => s.value));
+                                """)
+    for s in slider_list:
+        s.js_on_change('value', calc_call)
+
+
+    #callback for reset button. sets all sliders to original values, which recomputes the binding energies
+    reset_call = CustomJS(args=dict(slider_list=slider_list,value_list=value_list),
+                        code="""
+                                for (var N = 0; N < value_list.length; N++) {
+                                slider_list[N].value= value_list[N]}
+    """)
+    reset_button.js_on_click( reset_call)
+
+
+
+    #add colour bar
+    color_bar_height = 550 + 0
+    color_bar_width = 120
+    color_bar = ColorBar(color_mapper=color_mapper, 
+                         label_standoff=12, border_line_color=None, location=(0,0))
+    color_bar_plot = figure(title="Binding energy per nucleon/MeV", title_location="right", 
+                            height=color_bar_height, width=color_bar_width, 
+                            toolbar_location=None, min_border=0, 
+                            outline_line_color=None)
+    color_bar_plot.add_layout(color_bar, 'right')
+    color_bar_plot.title.align="center"
+    color_bar_plot.title.text_font_size = '12pt'
+
+    # Set up layouts 
+    inputs = column(reset_button, av_slider, as_slider, ac_slider, aa_slider, ap_slider, kp_slider)
+    layout = row(inputs, p,color_bar_plot,  width=800)
+
+    return layout
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Interactive plot of the semi-empirical mass formula.')
+    parser.add_argument('--grid', nargs='+', default=None, metavar='NxZ',
+                        help='largest neutron and proton numbers, e.g. 180x120, one page per grid')
+    args = parser.parse_args()
+
+    if args.grid is None:
+        pages = [(100, 100, "SEMF.html")]
+    else:
+        pages = []
+        for g in args.grid:
+            n_max, z_max = (int(v) for v in g.lower().split('x'))
+            pages.append((n_max, z_max, "SEMF_N%d_Z%d.html" % (n_max, z_max)))
+    for n_max, z_max, filename in pages:
+        layout = make_plot(n_max, z_max)
+        print("saving file", filename)
+        output_file(filename, title="SEMF")
+        save(layout)
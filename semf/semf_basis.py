@@ -0,0 +1,68 @@
+"""The semi-empirical mass formula as a weighted sum of basis images.
+
+The binding energy per nucleon is linear in aV, aS, aC, aA and aP:
+
+    E/A = aV - aS A**(2/3)/A - aC Z(Z-1) A**(-1/3)/A - aA (A-2Z)**2/A**2 + aP parity A**-kP/A
+
+so for a chart of nuclei SEMFBasis computes the images of the terms once, and
+a set of constants is a weighted sum of them. Only the pairing term depends on
+kP; its images are kept for the last cache_size values of kP (the kP slider of
+the page has 21). Sweeps over many constants are matrix products, one per
+distinct kP:
+
+    basis = SEMFBasis(N=np.arange(1, 181), Z=np.arange(1, 121))
+    E = basis(15.8, 18.3, 0.7, 23.2, 12, 0.5)
+    E = basis.sweep([[15.8, 18.3, 0.7, 23.2, 12, 0.5], [15.8, 18.3, 1.4, 23.2, 12, 0.5]])
+"""
+from functools import lru_cache
+
+import numpy as np
+
+
+class SEMFBasis:
+    """basis images of the nuclei of neutron numbers N (image columns) and proton numbers Z (image rows),
+        whole numbers. images holds the terms of aV, aS, aC and aA, divided by A and with their signs,
+        parity is +1 for even Z and N, -1 for odd Z and N and 0 otherwise"""
+
+    def __init__(self, N, Z, cache_size=32):
+        self.N = np.asarray(N, dtype=float)
+        self.Z = np.asarray(Z, dtype=float)
+        n, z = self.N[None, :], self.Z[:, None]
+        self.A = z + n
+        inv_A = 1. / self.A
+        cbrt_inv_A = np.cbrt(inv_A)
+        self.images = np.stack([np.ones_like(self.A), -cbrt_inv_A, -(z * (z - 1)) * cbrt_inv_A * inv_A,
+                                -((self.A - 2 * z) * inv_A) ** 2])
+        self.parity = 1 - z % 2 - n % 2
+        self.images.setflags(write=False)
+        self.pairing = lru_cache(maxsize=cache_size)(self._pairing)
+
+    @property
+    def shape(self):
+        return self.A.shape
+
+    def _pairing(self, kP):
+        """the image of the pairing term of kP, parity * A**-kP / A. read-only, it is shared through the cache"""
+        image = self.parity * self.A ** -kP / self.A
+        image.setflags(write=False)
+        return image
+
+    def __call__(self, aV, aS, aC, aA, aP, kP):
+        """binding energy per nucleon/MeV of every nucleus, of shape (len(Z), len(N))"""
+        E = np.tensordot([aV, aS, aC, aA], self.images, axes=1)
+        E += aP * self.pairing(float(kP))
+        return E
+
+    def sweep(self, constants):
+        """binding energies per nucleon/MeV of every row (aV, aS, aC, aA, aP, kP) of constants, of shape
+            (len(constants), len(Z), len(N)). memory grows with the number of rows: sweep long lists in parts"""
+        constants = np.atleast_2d(np.asarray(constants, dtype=float))
+        if constants.shape[1] != 6:
+            raise ValueError('constants of shape %s are not rows of (aV, aS, aC, aA, aP, kP)' % (constants.shape,))
+        size = self.A.size
+        E = constants[:, :4] @ self.images.reshape(4, size)
+        kPs, which = np.unique(constants[:, 5], return_inverse=True)
+        for i, kP in enumerate(kPs):
+            rows = np.flatnonzero(which == i)
+            E[rows] += constants[rows, 4:5] * self.pairing(float(kP)).reshape(1, size)
+        return E.reshape((len(constants),) + self.shape)